@@ -0,0 +1,182 @@
+from typing import AsyncIterator, Deque, Dict, List, Optional, Set
+from collections import defaultdict, deque
+import asyncio
+from config import settings
+
+
+class SlowConsumer(Exception):
+    """This is raised to a subscriber whose queue overflowed."""
+
+
+class Subscriber:
+    """This is a client following the live updates of a post. Its messages wait
+    in a bounded queue until they are sent. A vote count update replaces the
+    one still waiting (the deltas are added), so a client never lags behind by
+    more than one update of the counts.
+
+    Args:
+    -----
+    queue_size: The maximum number of messages waiting to be sent.
+    """
+
+    def __init__(self, queue_size: int) -> None:
+        self.queue_size = queue_size
+        self.queue: Deque[Dict] = deque()
+        self.ready = asyncio.Event()
+        self.dropped = False
+
+    def put(self, message: Dict) -> str:
+        """This is used to queue a message. It must be called from the event
+        loop.
+
+        Returns:
+        --------
+        outcome: "queued", "coalesced" or "dropped" (the queue is full: the
+        subscriber is disconnected).
+        """
+        if (
+            message["event"] == "votes"
+            and self.queue
+            and self.queue[-1]["event"] == "votes"
+        ):
+            waiting = self.queue[-1]
+            waiting["votes"] = message["votes"]
+            waiting["delta"] += message["delta"]
+            return "coalesced"
+        if len(self.queue) >= self.queue_size:
+            self.dropped = True
+            self.ready.set()
+            return "dropped"
+        self.queue.append(dict(message))  # copied: it may be coalesced
+        self.ready.set()
+        return "queued"
+
+    async def get(self, timeout: Optional[float] = None) -> List[Dict]:
+        """This is used to wait for the next messages.
+
+        Args:
+        -----
+        timeout: The maximum wait (in seconds). No message is returned if
+        nothing happened meanwhile.
+
+        Returns:
+        --------
+        messages: The messages queued since the last call, oldest first.
+        """
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self.ready.clear()
+        if self.dropped:
+            raise SlowConsumer()
+        messages = list(self.queue)
+        self.queue.clear()
+        return messages
+
+
+class Broadcaster:
+    """This fans out the updates of the posts to their subscribers. It lives in
+    the event loop, but the updates can be published from any thread (e.g. the
+    threadpool running the sync routes)."""
+
+    def __init__(self) -> None:
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._topics: Dict[int, Set[Subscriber]] = defaultdict(set)
+        self.counters = dict(published=0, queued=0, coalesced=0, dropped=0)
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """This is used to bind the broadcaster to the event loop of the app."""
+        self._loop = loop
+
+    def subscribe(self, post_id: int) -> Subscriber:
+        """This is used to follow a post. It must be called from the event loop."""
+        subscriber = Subscriber(settings.LIVE_QUEUE_SIZE)
+        self._topics[post_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, post_id: int, subscriber: Subscriber) -> None:
+        """This is used to stop following a post. It must be called from the
+        event loop."""
+        subscribers = self._topics.get(post_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._topics[post_id]
+
+    def publish(self, post_id: int, message: Dict) -> None:
+        """This is used to send a message to the subscribers of a post. It's
+        thread-safe and returns right away: the message is delivered by the
+        event loop. It costs nothing when the post has no subscriber.
+
+        Args:
+        -----
+        post_id: The ID of the post.
+        message: The JSON-serializable message. Its "event" is "votes" (with the
+        new "votes" count and the "delta") or "deleted".
+
+        Returns:
+        --------
+        None
+        """
+        if self._loop is None or post_id not in self._topics:
+            return
+        self._loop.call_soon_threadsafe(self._deliver, post_id, message)
+
+    def _deliver(self, post_id: int, message: Dict) -> None:
+        """This queues a message for every subscriber of a post."""
+        self.counters["published"] += 1
+        for subscriber in list(self._topics.get(post_id, ())):
+            outcome = subscriber.put(message)
+            self.counters[outcome] += 1
+            if outcome == "dropped":
+                self.unsubscribe(post_id, subscriber)
+
+    def stats(self) -> Dict[str, int]:
+        """This returns the number of subscribers and followed posts, and the
+        message counters."""
+        return {
+            "subscribers": sum(
+                len(subscribers) for subscribers in self._topics.values()
+            ),
+            "posts": len(self._topics),
+            **self.counters,
+        }
+
+
+# the broadcaster of the live routes, started with the app
+broadcaster = Broadcaster()
+
+
+def publish_votes(post_id: int, votes: int, delta: int) -> None:
+    """This is used to push the new vote count of a post to its subscribers,
+    once the votes are committed."""
+    message = {"event": "votes", "post_id": post_id, "votes": votes, "delta": delta}
+    broadcaster.publish(post_id, message)
+
+
+def publish_deleted(post_id: int) -> None:
+    """This is used to tell the subscribers of a post that it was deleted."""
+    broadcaster.publish(post_id, {"event": "deleted", "post_id": post_id})
+
+
+async def follow(subscriber: Subscriber) -> AsyncIterator[List[Dict]]:
+    """This is used to iterate over the messages of a subscriber, in batches.
+    The updates arriving within LIVE_COALESCE_SECONDS of a send are coalesced
+    into the next one. An empty batch is yielded after LIVE_HEARTBEAT_SECONDS
+    without any update (to keep the connection alive).
+
+    Args:
+    -----
+    subscriber: The subscriber.
+
+    Returns:
+    --------
+    batches: The batches of messages to send. It raises SlowConsumer when the
+    subscriber was dropped.
+    """
+    while True:
+        messages = await subscriber.get(timeout=settings.LIVE_HEARTBEAT_SECONDS)
+        yield messages
+        if messages and settings.LIVE_COALESCE_SECONDS > 0:
+            await asyncio.sleep(settings.LIVE_COALESCE_SECONDS)
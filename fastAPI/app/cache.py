@@ -0,0 +1,291 @@
+from typing import Any, Callable, Dict, Hashable, Optional
+from collections import OrderedDict
+import asyncio
+import pickle
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.util import await_only
+from config import settings
+import invalidation
+import metrics
+
+
+class CacheBackend:
+    """This is the interface every cache backend must implement."""
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """This returns the cached value of `key` or `default` if it's missing or
+        has expired."""
+        raise NotImplementedError
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """This caches `value` under `key` for `ttl` seconds (defaults to the
+        cache ttl)."""
+        raise NotImplementedError
+
+    def add(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> bool:
+        """This caches `value` under `key` like `set`, unless `key` is already
+        cached (even as None). It returns whether `value` was cached."""
+        raise NotImplementedError
+
+    def delete(self, key: Hashable) -> None:
+        """This removes `key` from the cache (if it's cached)."""
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        """This removes every entry from the cache."""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        """This returns the hit/miss/eviction counters (and the size, if known)."""
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    """This is a thread-safe, bounded in-process cache. The least recently used
+    entry is evicted when it's full and every entry expires after `ttl` seconds.
+
+    Args:
+    -----
+    maxsize: The maximum number of entries. A maxsize of 0 disables the cache.
+    ttl: The default time to live (in seconds) of an entry.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """This returns the cached value of `key` or `default` if it's missing or
+        has expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            if entry[0] is None:  # e.g. see `evict_post`
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """This caches `value` under `key` for `ttl` seconds (defaults to the
+        cache ttl)."""
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._store(key, value, expires_at)
+
+    def add(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> bool:
+        """This caches `value` under `key` like `set`, unless `key` is already
+        cached (even as None). It returns whether `value` was cached."""
+        if self.maxsize <= 0:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                return False
+            self._store(key, value, now + (self.ttl if ttl is None else ttl))
+        return True
+
+    def _store(self, key: Hashable, value: Any, expires_at: float) -> None:
+        """This stores an entry and evicts the least recently used ones beyond
+        maxsize. The lock must be held."""
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        """This removes `key` from the cache (if it's cached)."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_matching(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """This removes every entry for which `predicate(key, value)` is true.
+
+        Returns:
+        --------
+        num_deleted: The number of removed entries.
+        """
+        with self._lock:
+            keys = [k for k, (v, _) in self._entries.items() if predicate(k, v)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        """This removes every entry from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """This returns the hit/miss/eviction counters and the current size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+
+class RedisCache(CacheBackend):
+    """This is a cache shared by every worker/instance, kept in Redis. The keys
+    are prefixed with `namespace`, the values are pickled and Redis itself
+    expires (and evicts) the entries. It needs the `redis` package.
+
+    On the event loop (async mode), the commands go through an asyncio client,
+    so they don't block the other requests of the worker. See `_call`.
+
+    Args:
+    -----
+    url: The Redis URL, e.g. "redis://localhost:6379/0".
+    ttl: The default time to live (in seconds) of an entry.
+    namespace: The prefix of the keys of this cache.
+    """
+
+    def __init__(self, url: str, ttl: float, namespace: str) -> None:
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError:
+            raise RuntimeError("The redis cache backend needs the redis package.")
+        self.client = redis.Redis.from_url(url)
+        self.async_client = redis.asyncio.Redis.from_url(url)
+        self.ttl = ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key: Hashable) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _call(self, command: str, *args, **kwargs) -> Any:
+        """This runs a Redis command. In the sync code run on the event loop by
+        an async session (`utils.run_sync_route`, the session events), the
+        command of the asyncio client is awaited, like the queries of the
+        session. Elsewhere (threads, sync hooks) the blocking client is used."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:  # a thread, e.g. of the threadpool of the sync routes
+            return getattr(self.client, command)(*args, **kwargs)
+        coroutine = getattr(self.async_client, command)(*args, **kwargs)
+        try:
+            return await_only(coroutine)
+        except exc.MissingGreenlet:  # not run by an async session
+            coroutine.close()
+            return getattr(self.client, command)(*args, **kwargs)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._call("get", self._key(key))
+        value = None if value is None else pickle.loads(value)
+        if value is None:  # missing, or cached as None (e.g. see `evict_post`)
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        self._call("set", self._key(key), pickle.dumps(value), px=int(ttl * 1000))
+
+    def add(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> bool:
+        ttl = self.ttl if ttl is None else ttl
+        added = self._call(
+            "set", self._key(key), pickle.dumps(value), px=int(ttl * 1000), nx=True
+        )
+        return bool(added)
+
+    def delete(self, key: Hashable) -> None:
+        self._call("delete", self._key(key))
+
+    def clear(self) -> None:
+        cursor = None
+        while cursor != 0:
+            cursor, keys = self._call("scan", cursor or 0, match=f"{self.namespace}:*")
+            if keys:
+                self._call("delete", *keys)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def create_cache(
+    backend: str, maxsize: int, ttl: float, namespace: str
+) -> CacheBackend:
+    """This is used to create a cache with the configured backend.
+
+    Args:
+    -----
+    backend: "memory" (an LRUCache per process) or "redis" (shared).
+    maxsize: The maximum number of entries of a memory cache.
+    ttl: The default time to live (in seconds) of an entry.
+    namespace: The name of the cache (the key prefix of a shared cache).
+
+    Returns:
+    --------
+    cache: The cache, whose stats are exported with the other metrics.
+    """
+    if backend == "redis":
+        cache = RedisCache(settings.CACHE_REDIS_URL, ttl, namespace)
+    elif backend == "memory":
+        cache = LRUCache(maxsize, ttl)
+    else:
+        raise ValueError(f"Unknown cache backend: {backend}")
+    metrics.track_cache(namespace, cache)
+    return cache
+
+
+# the (ETag, PostResponse2 JSON) of GET /posts/{id}, by post id. The
+# entries are evicted (see `evict_post`) when the post is updated, deleted or
+# voted on, and only added if missing.
+post_cache = create_cache(
+    settings.POST_CACHE_BACKEND,
+    settings.POST_CACHE_SIZE,
+    settings.POST_CACHE_TTL_SECONDS,
+    namespace="posts",
+)
+
+
+def evict_post(post_id: int) -> None:
+    """This is used to evict a changed post from `post_cache`, after the change
+    committed. Its entry is replaced by None (a miss) for
+    POST_CACHE_EVICTION_SECONDS rather than deleted: a concurrent GET which loaded
+    the post before the change can't `add` its copy back meanwhile.
+
+    Args:
+    -----
+    post_id: The id of the changed post.
+    """
+    post_cache.set(post_id, None, ttl=settings.POST_CACHE_EVICTION_SECONDS)
+
+
+if settings.POST_CACHE_BACKEND == "memory":  # a shared cache is always in sync
+    invalidation.register("post", evict_post, post_cache.clear)
+
+# the users who wrote in the last READ_YOUR_WRITES_SECONDS (by id), whose reads
+# stay on the primary. It must be shared by the workers (redis backend): the next
+# request of a user may be served by another worker. It's only used with replicas.
+recent_writers: Optional[CacheBackend] = None
+if settings.DATABASE_REPLICA_URLS.strip():
+    recent_writers = create_cache(
+        settings.READ_YOUR_WRITES_BACKEND,
+        settings.READ_YOUR_WRITES_CACHE_SIZE,
+        settings.READ_YOUR_WRITES_SECONDS,
+        namespace="writers",
+    )
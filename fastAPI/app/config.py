@@ -12,6 +12,73 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRATION_MINUTES: int
+    # "postgres" (full-text search) or "memory" (in-process index for SQLite/tests)
+    SEARCH_BACKEND: str = "postgres"
+    # serve the routes with async handlers on an asyncpg AsyncEngine
+    DATABASE_ASYNC: bool = False
+    # cache of the users authenticated by recently seen access tokens
+    AUTH_CACHE_SIZE: int = 10000
+    AUTH_CACHE_TTL_SECONDS: int = 60
+    # bcrypt cost factor. Existing hashes are upgraded at login when it changes.
+    BCRYPT_ROUNDS: int = 12
+    # "process" or "thread" pool used for password hashing. 0 workers = CPU count
+    PASSWORD_HASHING_EXECUTOR: str = "process"
+    PASSWORD_HASHING_WORKERS: int = 0
+    # serialize with orjson (and skip the Pydantic validation of list endpoints)
+    FAST_JSON: bool = False
+    # connection pool of each engine. Recycle -1 = never, pre-ping tests the
+    # connections on checkout (e.g. after a database restart).
+    DATABASE_POOL_SIZE: int = 5
+    DATABASE_MAX_OVERFLOW: int = 10
+    DATABASE_POOL_TIMEOUT: float = 30
+    DATABASE_POOL_RECYCLE: int = -1
+    DATABASE_POOL_PRE_PING: bool = False
+    # read replicas (comma-separated postgresql:// URLs) used round-robin by the
+    # read-only routes. The reads of a user who wrote in the last
+    # READ_YOUR_WRITES_SECONDS stay on the primary, and a replica failing to
+    # connect is skipped for DATABASE_REPLICA_RETRY_SECONDS.
+    DATABASE_REPLICA_URLS: str = ""
+    READ_YOUR_WRITES_SECONDS: float = 5
+    DATABASE_REPLICA_RETRY_SECONDS: float = 30
+    # where the recent writers are kept: "redis" (shared by the workers) or
+    # "memory" (only right with a single worker), with room for this many users
+    READ_YOUR_WRITES_BACKEND: str = "redis"
+    READ_YOUR_WRITES_CACHE_SIZE: int = 100000
+    # log the statements slower than this (-1 = off), with the EXPLAIN (ANALYZE,
+    # BUFFERS) plan of this fraction of the slow SELECTs
+    SLOW_QUERY_THRESHOLD_MS: float = 500
+    SLOW_QUERY_EXPLAIN_RATE: float = 0
+    # cache of GET /posts/{id}: "memory" (per process) or "redis" (shared)
+    POST_CACHE_BACKEND: str = "memory"
+    POST_CACHE_SIZE: int = 10000
+    POST_CACHE_TTL_SECONDS: int = 30
+    # a changed post isn't cached again for this long (more than a read of the
+    # post takes), so a read which loaded it before the change can't cache it
+    POST_CACHE_EVICTION_SECONDS: float = 5
+    CACHE_REDIS_URL: str = "redis://localhost:6379/0"
+    # GET /posts/top and /posts/trending. A trending post needs twice the votes
+    # of a post this much newer to keep its rank. The in-process rankings hold
+    # the RANKING_SIZE best posts and are reloaded in the background this often
+    # (0 = never) to catch up with the other workers.
+    TRENDING_GRAVITY_HOURS: float = 12
+    RANKING_SIZE: int = 10000
+    RANKING_REBUILD_SECONDS: float = 300
+    # write-behind votes: they are buffered in memory and written in batches
+    # every VOTE_BUFFER_FLUSH_SECONDS, or once this many are pending
+    VOTE_BUFFER: bool = False
+    VOTE_BUFFER_FLUSH_SECONDS: float = 0.5
+    VOTE_BUFFER_MAX_PENDING: int = 1000
+    # live vote counts (/posts/{id}/live). The messages waiting per subscriber
+    # before it's dropped, the minimum delay between two sends (the updates
+    # meanwhile are coalesced), the keep-alive interval and the send timeout.
+    LIVE_QUEUE_SIZE: int = 16
+    LIVE_COALESCE_SECONDS: float = 0.2
+    LIVE_HEARTBEAT_SECONDS: float = 15
+    LIVE_SEND_TIMEOUT_SECONDS: float = 10
+    # evict the entries of the in-process caches changed by the other workers
+    # (Postgres LISTEN/NOTIFY). The listener reconnects this often after a failure.
+    CACHE_INVALIDATION: bool = False
+    CACHE_INVALIDATION_RETRY_SECONDS: float = 1
 
     class Config:
         """Used to import the .env file"""
@@ -1,7 +1,16 @@
-from sqlalchemy import create_engine
+from typing import List, Optional
+import itertools
+import time
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.util import greenlet_spawn
 from config import settings
+import cache
+import metrics
 
 
 # load the database credentials.
@@ -14,15 +23,240 @@ DATABASE_NAME = settings.DATABASE_NAME
 SQLALCHEMY_DATABASE_URL = (
     f"postgresql://{USER}:{PASSWORD}@{HOST}:{PORT}/{DATABASE_NAME}"
 )
+SQLALCHEMY_ASYNC_DATABASE_URL = (
+    f"postgresql+asyncpg://{USER}:{PASSWORD}@{HOST}:{PORT}/{DATABASE_NAME}"
+)
+
+
+class CheckoutTimer:
+    """This is a pool mixin recording how long each checkout waits for a
+    connection (and the checkouts timing out) in the metrics of the pool,
+    found by its `pool_logging_name`."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            metrics.pool_metrics[self.logging_name].checkout_timeouts += 1
+            raise
+        finally:
+            wait = time.perf_counter() - start
+            metrics.pool_metrics[self.logging_name].checkout_wait.observe(wait)
+
+
+class InstrumentedQueuePool(CheckoutTimer, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(CheckoutTimer, AsyncAdaptedQueuePool):
+    pass
+
+
+# the pool settings shared by the engines.
+pool_options = dict(
+    pool_size=settings.DATABASE_POOL_SIZE,
+    max_overflow=settings.DATABASE_MAX_OVERFLOW,
+    pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+    pool_recycle=settings.DATABASE_POOL_RECYCLE,
+    pool_pre_ping=settings.DATABASE_POOL_PRE_PING,
+)
+
+# the read replicas, in the order of settings.DATABASE_REPLICA_URLS
+REPLICA_URLS = [url.strip() for url in settings.DATABASE_REPLICA_URLS.split(",")]
+REPLICA_URLS = [url for url in REPLICA_URLS if url]
+
+
+class ReplicaSet:
+    """This holds the read replicas of the sync (or async) engine. They are used
+    round-robin, skipping for a while the ones that failed to connect."""
+
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self.engines: List = []
+        self.sessions: List[sessionmaker] = []
+        self.down_until: List[float] = []
+        self._turns = itertools.count()
+
+    def add(self, name: str, engine, session_factory: sessionmaker) -> None:
+        """This adds a replica, named after the `pool_logging_name` of its
+        engine."""
+        self.names.append(name)
+        self.engines.append(engine)
+        self.sessions.append(session_factory)
+        self.down_until.append(0.0)
+
+    def candidates(self) -> List[int]:
+        """This returns the indexes of the replicas to try for the next read:
+        the healthy ones, starting with the next one in the round."""
+        if not self.sessions:
+            return []
+        start = next(self._turns) % len(self.sessions)
+        now = time.monotonic()
+        order = list(range(start, len(self.sessions))) + list(range(start))
+        return [index for index in order if self.down_until[index] <= now]
+
+    def mark_down(self, index: int) -> None:
+        """This skips a replica that failed to connect (its reads go to the next
+        one, or to the primary)."""
+        metrics.pool_metrics[self.names[index]].connect_failures += 1
+        retry_at = time.monotonic() + settings.DATABASE_REPLICA_RETRY_SECONDS
+        self.down_until[index] = retry_at
+
+
+# the engines are created by `init_engines` (at startup), so importing the app
+# doesn't load the database drivers nor touch the database.
+engine = None
+async_engine = None
+replicas = ReplicaSet()
+async_replicas = ReplicaSet()
+
+# create a communication session for the postgres DB. It's bound to the engine
+# by `init_engines`.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+# the async session is only used when the async routes are enabled.
+AsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, class_=AsyncSession)
 
-# create engine for connection to postgres
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
 
-# create a communication session for the postgres DB
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def init_engines() -> None:
+    """This is used to create the engine (and the async engine when the async
+    routes are enabled) and bind the sessions to them. It's idempotent.
+
+    Returns:
+    --------
+    None
+    """
+    global engine, async_engine
+    if engine is None:
+        engine = create_engine(
+            SQLALCHEMY_DATABASE_URL,
+            poolclass=InstrumentedQueuePool,
+            pool_logging_name="primary",
+            **pool_options,
+        )
+        metrics.track_pool("primary", engine)
+        SessionLocal.configure(bind=engine)
+        for index, url in enumerate(REPLICA_URLS):
+            name = f"replica{index}"
+            replica_engine = create_engine(
+                url,
+                poolclass=InstrumentedQueuePool,
+                pool_logging_name=name,
+                **pool_options,
+            )
+            metrics.track_pool(name, replica_engine)
+            session_factory = sessionmaker(
+                autocommit=False,
+                autoflush=False,
+                bind=replica_engine,
+                info={"replica": name},
+            )
+            replicas.add(name, replica_engine, session_factory)
+
+    if settings.DATABASE_ASYNC and async_engine is None:
+        async_engine = create_async_engine(
+            SQLALCHEMY_ASYNC_DATABASE_URL,
+            poolclass=InstrumentedAsyncQueuePool,
+            pool_logging_name="async",
+            **pool_options,
+        )
+        metrics.track_pool("async", async_engine.sync_engine)
+        AsyncSessionLocal.configure(bind=async_engine)
+        for index, url in enumerate(REPLICA_URLS):
+            name = f"async_replica{index}"
+            replica_engine = create_async_engine(
+                make_url(url).set(drivername="postgresql+asyncpg"),
+                poolclass=InstrumentedAsyncQueuePool,
+                pool_logging_name=name,
+                **pool_options,
+            )
+            metrics.track_pool(name, replica_engine.sync_engine)
+            session_factory = sessionmaker(
+                autocommit=False,
+                autoflush=False,
+                bind=replica_engine,
+                class_=AsyncSession,
+                info={"replica": name},
+            )
+            async_replicas.add(name, replica_engine, session_factory)
+
+
+async def dispose_engines() -> None:
+    """This is used to close the connections of the engines."""
+    if engine is not None:
+        engine.dispose()
+    for replica_engine in replicas.engines:
+        replica_engine.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
+    for replica_engine in async_replicas.engines:
+        await replica_engine.dispose()
+
+
+@event.listens_for(Session, "after_commit")
+def record_write(session: Session) -> None:
+    """This starts the read-your-writes window of the user whose request just
+    committed (the user id is set by `oauth2.get_current_user`). The commit of an
+    async session runs it in a greenlet, where a shared cache awaits its write."""
+    user_id = session.info.get("user_id")
+    if user_id is not None and cache.recent_writers is not None:
+        cache.recent_writers.set(user_id, True)
+
+
+def wrote_recently(user_id: Optional[int]) -> bool:
+    """This tells whether the reads of a user must stay on the primary, because
+    the replicas may not have replayed the user's last writes yet."""
+    return (
+        user_id is not None
+        and cache.recent_writers is not None
+        and cache.recent_writers.get(user_id) is not None
+    )
+
+
+def read_session(user_id: Optional[int] = None) -> Session:
+    """This is used to open the session of a read-only request. It's a session
+    of the next healthy replica (round-robin), or of the primary if there's none
+    or the user wrote recently.
+
+    Args:
+    -----
+    user_id: The ID of the logged in user.
+
+    Returns:
+    --------
+    db: The database session. Its `info["replica"]` is the replica name.
+    """
+    if replicas.sessions and not wrote_recently(user_id):
+        for index in replicas.candidates():
+            db = replicas.sessions[index]()
+            try:
+                db.connection()  # connect now, to fall back before the route runs
+                return db
+            except (exc.DBAPIError, OSError):
+                db.close()
+                replicas.mark_down(index)
+    return SessionLocal()
+
+
+async def async_read_session(user_id: Optional[int] = None) -> AsyncSession:
+    """This is the async version of `read_session`."""
+    # in a greenlet, so a shared cache of the recent writers awaits its lookup
+    # (see `cache.RedisCache`) instead of blocking the event loop
+    if async_replicas.sessions and not await greenlet_spawn(wrote_recently, user_id):
+        for index in async_replicas.candidates():
+            db = async_replicas.sessions[index]()
+            try:
+                await db.connection()
+                return db
+            except (exc.DBAPIError, OSError):
+                await db.close()
+                async_replicas.mark_down(index)
+    return AsyncSessionLocal()
+
 
 Base = declarative_base()
 
+
 # Dependency
 def get_db():
     """This creates an independent database session/connection (SessionLocal)
@@ -32,3 +266,10 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """This creates an independent async database session (AsyncSessionLocal)
+    per request."""
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,236 @@
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from typing import Union
+import csv
+import io
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.orm import Session
+from sqlalchemy.util import await_only
+import models
+import schemas
+
+
+# the number of posts inserted (and committed) at once
+BULK_CHUNK_SIZE = 1000
+
+# the columns written by the bulk insert. The others use their server default.
+POST_COLUMNS = ("id", "title", "content", "is_published", "owner_id")
+
+bulk_media_types = ("application/x-ndjson", "text/csv")
+
+
+def parse_csv_record(record: str, header: List[str]) -> schemas.PostCreate:
+    """This is used to validate a record of a CSV upload.
+
+    Args:
+    -----
+    record: The (possibly multi-line) CSV record.
+    header: The column names taken from the first record.
+
+    Returns:
+    --------
+    post: The validated post.
+    """
+    values = next(csv.reader([record]))
+    if len(values) != len(header):
+        raise ValueError(f"Expected {len(header)} columns, got {len(values)}.")
+    return schemas.PostCreate(**dict(zip(header, values)))
+
+
+async def iter_records(
+    body: AsyncIterator[bytes], is_csv: bool
+) -> AsyncIterator[Tuple[int, bytes]]:
+    """This is used to split the body of an upload into records while it's being
+    received. A record is a line, or several lines for a CSV record with a
+    quoted field containing newlines.
+
+    Args:
+    -----
+    body: The chunks of the request body.
+    is_csv: Whether the body is CSV (else NDJSON).
+
+    Returns:
+    --------
+    records: (number of the first line, record) for each record.
+    """
+    buffer = b""
+    record_lines: List[bytes] = []
+    num_quotes, line_number = 0, 0
+
+    async for chunk in body:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            record_lines.append(line.rstrip(b"\r"))
+            num_quotes += line.count(b'"')
+            if is_csv and num_quotes % 2:  # a quoted field is still open
+                continue
+            yield line_number - len(record_lines) + 1, b"\n".join(record_lines)
+            record_lines, num_quotes = [], 0
+
+    # the last line may not end with a newline
+    if buffer:
+        line_number += 1
+        record_lines.append(buffer.rstrip(b"\r"))
+    if record_lines:
+        yield line_number - len(record_lines) + 1, b"\n".join(record_lines)
+
+
+async def parse_posts(
+    body: AsyncIterator[bytes], media_type: str
+) -> AsyncIterator[Tuple[int, Union[schemas.PostCreate, str]]]:
+    """This is used to parse and validate an NDJSON/CSV upload while it's being
+    received, so the whole body is never held in memory.
+
+    Args:
+    -----
+    body: The chunks of the request body.
+    media_type: "application/x-ndjson" or "text/csv" (with a header record).
+
+    Returns:
+    --------
+    results: (line number, validated post or error message) for each record.
+    """
+    if media_type not in bulk_media_types:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"The body must be one of: {', '.join(bulk_media_types)}.",
+        )
+    is_csv = media_type == "text/csv"
+    header: Optional[List[str]] = None
+
+    async for line_number, record in iter_records(body, is_csv):
+        if not record.strip():
+            continue
+        try:
+            record = record.decode("utf-8")
+            if is_csv and header is None:
+                header = [column.strip() for column in next(csv.reader([record]))]
+                continue
+            if is_csv:
+                post = parse_csv_record(record, header)
+            else:
+                post = schemas.PostCreate.parse_raw(record)
+        except (ValidationError, ValueError, csv.Error) as e:
+            yield line_number, str(e)
+            continue
+        yield line_number, post
+
+
+async def bulk_insert(
+    body: AsyncIterator[bytes],
+    media_type: str,
+    insert_chunk: Callable[[List[schemas.PostCreate]], Awaitable[List[int]]],
+) -> Dict:
+    """This is used to validate an upload while it's being received and insert
+    its valid posts in chunks of BULK_CHUNK_SIZE.
+
+    Args:
+    -----
+    body: The chunks of the request body.
+    media_type: "application/x-ndjson" or "text/csv" (with a header record).
+    insert_chunk: Inserts a chunk of posts and returns their ids.
+
+    Returns:
+    --------
+    bulk_result: The ids of the inserted posts and the invalid lines.
+    """
+    inserted_ids, errors, chunk = [], [], []
+    async for line_number, result in parse_posts(body, media_type):
+        if isinstance(result, str):
+            errors.append({"line": line_number, "error": result})
+            continue
+        chunk.append(result)
+        if len(chunk) == BULK_CHUNK_SIZE:
+            inserted_ids += await insert_chunk(chunk)
+            chunk = []
+    if chunk:
+        inserted_ids += await insert_chunk(chunk)
+
+    bulk_result = {"inserted_ids": inserted_ids, "errors": errors}
+    return bulk_result
+
+
+def insert_posts(
+    db: Session, posts: List[schemas.PostCreate], owner_id: int
+) -> List[int]:
+    """This is used to insert a chunk of posts and commit them. It uses COPY on
+    Postgres (psycopg2 or asyncpg) and an executemany INSERT on other databases.
+
+    Args:
+    -----
+    db: The (sync) database session.
+    posts: The validated posts.
+    owner_id: The ID of the user who uploaded the posts.
+
+    Returns:
+    --------
+    post_ids: The ids of the inserted posts, in the same order.
+    """
+    if not posts:
+        return []
+    dialect = db.get_bind().dialect
+
+    if dialect.name == "postgresql":
+        # reserve the ids first, since COPY can't return them
+        post_ids = list(
+            db.execute(
+                text(
+                    "SELECT nextval(pg_get_serial_sequence('posts', 'id')) "
+                    "FROM generate_series(1, :num_posts)"
+                ),
+                {"num_posts": len(posts)},
+            ).scalars()
+        )
+        records = [
+            (id, post.title, post.content, post.is_published, owner_id)
+            for id, post in zip(post_ids, posts)
+        ]
+        dbapi_connection = db.connection().connection
+        if dialect.driver == "asyncpg":
+            await_only(
+                dbapi_connection.driver_connection.copy_records_to_table(
+                    "posts", records=records, columns=POST_COLUMNS
+                )
+            )
+        else:
+            copy_posts_psycopg2(dbapi_connection, records)
+    else:
+        # e.g. SQLite (a single writer), where the ids can be allocated upfront
+        last_id = db.execute(select(func.coalesce(func.max(models.Posts.id), 0)))
+        first_id = last_id.scalar() + 1
+        post_ids = list(range(first_id, first_id + len(posts)))
+        db.execute(
+            insert(models.Posts),
+            [
+                dict(id=id, owner_id=owner_id, **post.dict())
+                for id, post in zip(post_ids, posts)
+            ],
+        )
+    db.commit()
+    return post_ids
+
+
+def copy_posts_psycopg2(dbapi_connection, records: List[Tuple]) -> None:
+    """This is used to COPY the posts with psycopg2.
+
+    Args:
+    -----
+    dbapi_connection: The psycopg2 connection of the session.
+    records: The (id, title, content, is_published, owner_id) of the posts.
+
+    Returns:
+    --------
+    None
+    """
+    data = io.StringIO()
+    # the strings are quoted, so an empty string isn't read as NULL
+    csv.writer(data, quoting=csv.QUOTE_NONNUMERIC).writerows(records)
+    data.seek(0)
+    with dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY posts ({', '.join(POST_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            data,
+        )
@@ -0,0 +1,191 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import logging
+import select
+import threading
+import time
+import psycopg2
+from sqlalchemy import func
+from sqlalchemy.sql import ColumnElement
+from sqlalchemy.sql import select as sql_select
+from config import settings
+
+logger = logging.getLogger("app.invalidation")
+
+# the notifications are sent on this channel as "<kind>:<id>,<id>,...", e.g.
+# "post:12,13". A payload must stay under 8000 bytes.
+CHANNEL = "cache_invalidation"
+MAX_PAYLOAD_BYTES = 7900
+
+# the LISTEN connection is checked when it has been idle this long (seconds)
+PING_SECONDS = 30
+
+# the (evict one id, flush everything) callbacks of the local caches, by kind
+handlers: Dict[str, List[Tuple[Callable[[int], object], Callable[[], object]]]] = {}
+
+
+def register(kind: str, evict: Callable[[int], object], flush: Callable[[], object]):
+    """This is used to keep a local cache in sync with the other workers.
+
+    Args:
+    -----
+    kind: The kind of the cached entities, e.g. "post".
+    evict: Called with the id of an entity changed by any worker.
+    flush: Called to empty the cache when notifications may have been missed.
+    """
+    handlers.setdefault(kind, []).append((evict, flush))
+
+
+def notify(db, kind: str, ids: Iterable[int]) -> None:
+    """This is used to tell every worker that some entities changed, so they
+    evict them from their caches. The notification is part of the transaction:
+    Postgres only sends it at commit (and drops it on rollback).
+
+    Args:
+    -----
+    db: The session (or connection) writing the changes.
+    kind: The kind of the entities, e.g. "post".
+    ids: Their ids.
+
+    Returns:
+    --------
+    None
+    """
+    if not settings.CACHE_INVALIDATION:
+        return
+    for payload in format_payloads(kind, ids):
+        db.execute(sql_select(func.pg_notify(CHANNEL, payload)))
+
+
+def returning(kind: str, id_column) -> List[ColumnElement]:
+    """This is used to notify the changes of an INSERT/UPDATE/DELETE within the
+    statement itself: it returns the extra RETURNING column calling pg_notify for
+    each returned row (none when the invalidation is off). It saves the round
+    trip of `notify`.
+
+    Args:
+    -----
+    kind: The kind of the entities, e.g. "post".
+    id_column: The id column of the returned rows.
+
+    Returns:
+    --------
+    columns: The columns to add to the RETURNING clause (after the others).
+    """
+    if not settings.CACHE_INVALIDATION:
+        return []
+    payload = func.concat(f"{kind}:", id_column)
+    return [func.pg_notify(CHANNEL, payload).label("notified")]
+
+
+def format_payloads(kind: str, ids: Iterable[int]) -> List[str]:
+    """This splits the ids of a notification into payloads small enough for
+    NOTIFY."""
+    payloads, chunk = [], []
+    size = len(kind) + 1
+    for id in sorted(set(ids)):
+        if chunk and size + len(str(id)) + 1 > MAX_PAYLOAD_BYTES:
+            payloads.append(f"{kind}:{','.join(chunk)}")
+            chunk, size = [], len(kind) + 1
+        chunk.append(str(id))
+        size += len(str(id)) + 1
+    if chunk:
+        payloads.append(f"{kind}:{','.join(chunk)}")
+    return payloads
+
+
+def apply(payload: str) -> None:
+    """This evicts the entities of a notification from the local caches."""
+    kind, _, ids = payload.partition(":")
+    for evict, _ in handlers.get(kind, ()):
+        for id in ids.split(","):
+            evict(int(id))
+
+
+def flush_all() -> None:
+    """This empties every local cache kept in sync."""
+    for kind_handlers in handlers.values():
+        for _, flush in kind_handlers:
+            flush()
+
+
+class Listener:
+    """This is the thread of a worker listening to the invalidations of every
+    worker (LISTEN). When its connection fails, it reconnects every
+    CACHE_INVALIDATION_RETRY_SECONDS and then flushes the local caches, since
+    the notifications sent meanwhile are lost."""
+
+    def __init__(self) -> None:
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.connected = False
+        self.counters = dict(notifications=0, reconnects=0, flushes=0)
+
+    def start(self, url: str) -> None:
+        """This is used to start listening.
+
+        Args:
+        -----
+        url: The postgresql:// URL of the (primary) database.
+        """
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(url,), name="cache-invalidation", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, url: str) -> None:
+        while not self._stopping.is_set():
+            try:
+                self._listen(url)
+            except (psycopg2.Error, OSError) as e:
+                logger.warning("The cache invalidation listener failed: %r", e)
+            self.connected = False
+            if not self._stopping.is_set():
+                self.counters["reconnects"] += 1
+                self._stopping.wait(settings.CACHE_INVALIDATION_RETRY_SECONDS)
+
+    def _listen(self, url: str) -> None:
+        """This listens until the connection fails or the thread is stopped."""
+        connection = psycopg2.connect(url)
+        try:
+            connection.autocommit = True
+            cursor = connection.cursor()
+            cursor.execute(f"LISTEN {CHANNEL}")
+            # whatever changed before LISTEN (e.g. while disconnected) is unknown
+            flush_all()
+            self.counters["flushes"] += 1
+            self.connected = True
+
+            last_activity = time.monotonic()
+            while not self._stopping.is_set():
+                # wake up every second to check whether the thread is stopped
+                if select.select([connection], [], [], 1)[0]:
+                    connection.poll()
+                    last_activity = time.monotonic()
+                elif time.monotonic() - last_activity > PING_SECONDS:
+                    cursor.execute("SELECT 1")  # raises if the connection died
+                    last_activity = time.monotonic()
+                while connection.notifies:
+                    notification = connection.notifies.pop(0)
+                    self.counters["notifications"] += 1
+                    try:
+                        apply(notification.payload)
+                    except Exception:
+                        logger.exception("Invalid notification: %s", notification)
+        finally:
+            connection.close()
+
+    def stop(self) -> None:
+        """This stops the thread (within a second)."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> Dict[str, int]:
+        """This returns whether it's connected and its counters."""
+        return {"connected": int(self.connected), **self.counters}
+
+
+# the listener of the worker (only started when settings.CACHE_INVALIDATION is on)
+listener = Listener()
@@ -1,17 +1,87 @@
-import os
-import sys
-import uvicorn
+import asyncio
 from fastapi import FastAPI
-import models
-from database import engine
+from fastapi.responses import JSONResponse, ORJSONResponse
+import broadcast
+import database
+import invalidation
+import ranking
+import metrics as app_metrics
+import querylog
+import search
+import utils
+import votebuffer
+from config import settings
 
-from routes import post, user, login, vote
+from routes import post, user, login, vote, metrics, live
 
-# create Postgres Table(s)
-models.Base.metadata.create_all(bind=engine)
+# the schema is created/upgraded by `python manage.py migrate`, never by the app
+# (so the workers boot without touching the database nor racing on DDL).
+app = FastAPI(
+    default_response_class=ORJSONResponse if settings.FAST_JSON else JSONResponse
+)
 
+# record the latency, status codes and SQL statements of the requests per route
+app.add_middleware(app_metrics.MetricsMiddleware)
+app_metrics.track_queries()
+querylog.track_slow_queries()
+
+
+@app.on_event("startup")
+def start_hashing_executor():
+    """This creates the password hashing pool, first: before the threads of the
+    other hooks and of the requests."""
+    utils.get_hashing_executor()
+
+
+@app.on_event("startup")
+def init_database():
+    """This creates the database engine(s) of the worker."""
+    database.init_engines()
+
+
+@app.on_event("startup")
+def start_rankings():
+    """This starts the thread loading (and reloading) the posts rankings."""
+    ranking.start()
+
+
+@app.on_event("startup")
+def start_slow_query_log():
+    """This starts the thread writing the slow query logs."""
+    querylog.start_listener()
+
+
+@app.on_event("startup")
+def start_vote_buffer():
+    """This starts the thread writing the buffered votes (write-behind mode)."""
+    if settings.VOTE_BUFFER:
+        votebuffer.buffer.start()
+
+
+@app.on_event("startup")
+def start_cache_invalidation():
+    """This starts the thread evicting the cache entries changed by the other
+    workers."""
+    if settings.CACHE_INVALIDATION:
+        invalidation.listener.start(database.SQLALCHEMY_DATABASE_URL)
+
+
+@app.on_event("startup")
+async def start_broadcaster():
+    """This binds the live updates broadcaster to the event loop."""
+    broadcast.broadcaster.start(asyncio.get_running_loop())
+
+
+@app.on_event("startup")
+def build_search_index():
+    """This loads the existing posts into the search index (if the configured
+    search backend keeps one)."""
+    db = database.SessionLocal()
+    try:
+        search.backend.rebuild(db)
+    finally:
+        db.close()
 
-app = FastAPI()
 
 @app.get("/")
 def root():
@@ -19,10 +89,51 @@ def root():
     """
     return {"msg": "Welcome! Your setup was correctly done."}
 
-app.include_router(post.router)
-app.include_router(user.router)
-app.include_router(login.router)
-app.include_router(vote.router)
+
+# the shutdown hooks run in order: the buffered votes are written before the
+# engines are closed.
+@app.on_event("shutdown")
+def drain_vote_buffer():
+    """This writes the buffered votes and stops their thread."""
+    if settings.VOTE_BUFFER:
+        votebuffer.buffer.stop()
+
+
+@app.on_event("shutdown")
+def stop_rankings():
+    """This stops the thread reloading the posts rankings."""
+    ranking.stop()
+
+
+@app.on_event("shutdown")
+async def close_engines():
+    """This closes the connections of the engine(s)."""
+    await database.dispose_engines()
+
+
+@app.on_event("shutdown")
+def stop_cache_invalidation():
+    """This stops the cache invalidation thread."""
+    invalidation.listener.stop()
+
+
+@app.on_event("shutdown")
+def stop_slow_query_log():
+    """This writes the pending slow query logs and stops their thread."""
+    querylog.stop_listener()
+
+
+@app.on_event("shutdown")
+def stop_hashing_executor():
+    """This stops the password hashing pool."""
+    utils.shutdown_hashing_executor()
+
+
+# the async routes are used when the async database layer is enabled.
+for route in (post, user, login, vote, metrics, live):
+    app.include_router(route.async_router if settings.DATABASE_ASYNC else route.router)
 
 if __name__ == "__main__":
+    import uvicorn  # only needed to run the dev server (not by the workers)
+
     uvicorn.run("main:app", port=8000, reload=True)
@@ -0,0 +1,67 @@
+import argparse
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+import database
+import migrations
+import models
+
+
+def reconcile_vote_counts(db: Session) -> int:
+    """This is used to backfill/reconcile the denormalized vote counter of every
+    post with the actual number of rows in the votes table.
+
+    Args:
+    -----
+    db: The database session.
+
+    Returns:
+    --------
+    num_fixed: The number of posts whose vote counter was corrected.
+    """
+    actual_votes = (
+        select(func.count(models.Votes.post_id))
+        .where(models.Votes.post_id == models.Posts.id)
+        .scalar_subquery()
+    )
+    num_fixed = (
+        db.query(models.Posts)
+        .filter(models.Posts.vote_count != actual_votes)
+        .update({models.Posts.vote_count: actual_votes}, synchronize_session=False)
+    )
+    db.commit()
+    return num_fixed
+
+
+def main() -> None:
+    """This is the entrypoint for the maintenance commands.
+
+    Example:
+    --------
+    python manage.py migrate
+    """
+    parser = argparse.ArgumentParser(description="Maintenance commands.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser(
+        "migrate", help="Create/upgrade the database schema (before deploying)."
+    )
+    commands.add_parser(
+        "reconcile-votes", help="Backfill/reconcile the vote counter on posts."
+    )
+    args = parser.parse_args()
+
+    database.init_engines()
+    if args.command == "migrate":
+        applied = migrations.migrate(database.engine)
+        print(f"Applied {len(applied)} migration(s): {', '.join(applied) or '-'}")
+    elif args.command == "reconcile-votes":
+        db = database.SessionLocal()
+        try:
+            num_fixed = reconcile_vote_counts(db)
+        finally:
+            db.close()
+        print(f"Reconciled the vote counter of {num_fixed} post(s).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,417 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# the upper bounds (in seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+DEFAULT_BUCKETS += (0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# the upper bounds of the histogram of the number of SQL statements per request
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    """This is a thread-safe histogram with fixed buckets. It's cheap to update
+    and gives approximate quantiles (e.g. p50/p95/p99).
+
+    Args:
+    -----
+    buckets: The sorted upper bounds of the buckets. Larger values are counted
+    in an extra +Inf bucket.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """This is used to record a value."""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """This returns an estimate of the q-quantile (0 < q < 1). It's linearly
+        interpolated within the bucket it falls into (and within the min/max)."""
+        with self._lock:
+            counts, total = list(self.counts), self.count
+            lowest, highest = self.min, self.max
+        if not total:
+            return None
+        bounds = self.buckets + (highest,)  # the +Inf bucket ends at the max
+        rank, cumulative = q * total, 0
+        for index, count in enumerate(counts):
+            if count and cumulative + count >= rank:
+                lower = max(bounds[index - 1] if index else lowest, lowest)
+                upper = min(bounds[index], highest)
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return highest
+
+    def cumulative_counts(self) -> List[int]:
+        """This returns the number of values <= each bucket bound (and +Inf)."""
+        with self._lock:
+            counts = list(self.counts)
+        cumulative, total = [], 0
+        for count in counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def summary(self) -> Dict:
+        """This returns the count, sum and p50/p95/p99 of the values."""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class PoolMetrics:
+    """This holds the counters of a connection pool, updated by pool events."""
+
+    def __init__(self) -> None:
+        self.checkout_wait = Histogram()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.connections_created = 0
+        self.connections_invalidated = 0
+        self.connect_failures = 0  # the replica reads sent elsewhere
+
+
+# the metrics of every tracked pool, keyed by the pool name
+pool_metrics: Dict[str, PoolMetrics] = defaultdict(PoolMetrics)
+# the engines whose pool is tracked, keyed by the pool name
+tracked_engines: Dict[str, Engine] = {}
+# the caches whose stats are exported, keyed by the cache name
+tracked_caches: Dict[str, Any] = {}
+
+
+def track_pool(name: str, engine: Engine) -> None:
+    """This is used to collect the statistics of the connection pool of an
+    engine. The checkout wait times are recorded by the instrumented pool
+    classes of database.py.
+
+    Args:
+    -----
+    name: The pool name (it must be the `pool_logging_name` of the engine).
+    engine: The (sync) engine.
+
+    Returns:
+    --------
+    None
+    """
+    tracked_engines[name] = engine
+    metrics = pool_metrics[name]
+
+    @event.listens_for(engine, "connect")
+    def count_connection(dbapi_connection, connection_record):
+        metrics.connections_created += 1
+
+    @event.listens_for(engine, "checkout")
+    def count_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.checkouts += 1
+
+    @event.listens_for(engine, "invalidate")
+    def count_invalidation(dbapi_connection, connection_record, exception):
+        metrics.connections_invalidated += 1
+
+
+def track_cache(name: str, cache) -> None:
+    """This is used to export the stats (hits, misses, ...) of a cache."""
+    tracked_caches[name] = cache
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    """This returns the stats of every tracked cache."""
+    return {name: cache.stats() for name, cache in tracked_caches.items()}
+
+
+def pool_stats() -> Dict[str, Dict]:
+    """This returns the live statistics of every tracked pool.
+
+    Returns:
+    --------
+    stats: The pool size, checked in/out and overflow connections, the event
+    counters and the checkout wait time distribution (in seconds) per pool.
+    """
+    stats = {}
+    for name, engine in tracked_engines.items():
+        pool, metrics = engine.pool, pool_metrics[name]
+        stats[name] = {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "checkouts": metrics.checkouts,
+            "checkout_timeouts": metrics.checkout_timeouts,
+            "connections_created": metrics.connections_created,
+            "connections_invalidated": metrics.connections_invalidated,
+            "connect_failures": metrics.connect_failures,
+            "checkout_wait_seconds": metrics.checkout_wait.summary(),
+        }
+    return stats
+
+
+class RouteMetrics:
+    """This holds the metrics of a route (method and path template)."""
+
+    def __init__(self) -> None:
+        self.responses: Dict[int, int] = defaultdict(int)
+        self.latency = Histogram()
+        self.sql_statements = Histogram(STATEMENT_BUCKETS)
+        self.sql_time = Histogram()
+        self._lock = threading.Lock()
+
+    def record(self, status_code: int, latency: float, request: "RequestStats"):
+        """This is used to record a request served by the route."""
+        with self._lock:
+            self.responses[status_code] += 1
+        self.latency.observe(latency)
+        self.sql_statements.observe(request.statements)
+        self.sql_time.observe(request.sql_time)
+
+
+class RequestStats:
+    """This holds the number and time of the SQL statements of a request."""
+
+    __slots__ = ("scope", "statements", "sql_time")
+
+    def __init__(self, scope: Dict) -> None:
+        self.scope = scope
+        self.statements = 0
+        self.sql_time = 0.0
+
+
+# the metrics of every route, keyed by (method, path template)
+route_metrics: Dict[Tuple[str, str], RouteMetrics] = defaultdict(RouteMetrics)
+# the stats of the request being served (shared with the threadpool/greenlets)
+current_request: ContextVar[Optional[RequestStats]] = ContextVar(
+    "current_request", default=None
+)
+# the path templates of the route endpoints
+route_templates: Dict[Callable, str] = {}
+
+# the label of the requests matching no route (to bound the number of series)
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def route_template(scope: Dict) -> str:
+    """This returns the path template (e.g. "/posts/{id}") of the route which
+    served a request, from the endpoint set in its scope by the router."""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return UNMATCHED_ROUTE
+    if endpoint not in route_templates:
+        for route in scope["app"].routes:
+            if getattr(route, "endpoint", None) is endpoint:
+                route_templates[endpoint] = route.path
+                break
+        else:
+            route_templates[endpoint] = UNMATCHED_ROUTE
+    return route_templates[endpoint]
+
+
+def current_route() -> Optional[str]:
+    """This returns the route ("METHOD /path/template") of the request being
+    served, if any."""
+    request = current_request.get()
+    if request is None:
+        return None
+    return f"{request.scope['method']} {route_template(request.scope)}"
+
+
+class MetricsMiddleware:
+    """This is an ASGI middleware recording the latency, status code and SQL
+    statements of each HTTP request, per route. The latency includes the body
+    of streaming responses.
+
+    Args:
+    -----
+    app: The ASGI application.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = RequestStats(scope)
+        token = current_request.set(request)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            latency = time.perf_counter() - start
+            current_request.reset(token)
+            key = (scope["method"], route_template(scope))
+            route_metrics[key].record(status_code, latency, request)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    """This stores the start time of a statement (of a request) on its execution
+    context, which is discarded with the statement even if it fails."""
+    if context is not None and current_request.get() is not None:
+        context.metrics_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    """This adds a statement and its duration to the stats of the request."""
+    request = current_request.get()
+    start = getattr(context, "metrics_start", None)
+    if request is not None and start is not None:
+        request.statements += 1
+        request.sql_time += time.perf_counter() - start
+
+
+def handle_error(exception_context) -> None:
+    """This adds a failed statement (e.g. a constraint violation) to the stats of
+    the request, since `after_cursor_execute` isn't called for it."""
+    after_cursor_execute(
+        exception_context.connection,
+        exception_context.cursor,
+        exception_context.statement,
+        exception_context.parameters,
+        exception_context.execution_context,
+        False,
+    )
+
+
+def track_queries() -> None:
+    """This is used to count and time the SQL statements of every engine (sync
+    and async) per request."""
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(Engine, "handle_error", handle_error)
+
+
+def route_stats() -> Dict[str, Dict]:
+    """This returns the statistics of every route.
+
+    Returns:
+    --------
+    stats: The responses per status code, the latency (in seconds) and the SQL
+    statements per request of each route ("METHOD /path/template").
+    """
+    stats = {}
+    for (method, path), metrics in list(route_metrics.items()):
+        stats[f"{method} {path}"] = {
+            "responses": dict(metrics.responses),
+            "latency_seconds": metrics.latency.summary(),
+            "sql_statements": metrics.sql_statements.summary(),
+            "sql_seconds": metrics.sql_time.summary(),
+        }
+    return stats
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    """This formats the labels of a Prometheus sample."""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_histogram(name: str, labels: Dict[str, str], histogram: Histogram):
+    """This returns the Prometheus samples of a histogram."""
+    bounds = [str(bound) for bound in histogram.buckets] + ["+Inf"]
+    lines = [
+        f"{name}_bucket{format_labels({**labels, 'le': bound})} {count}"
+        for bound, count in zip(bounds, histogram.cumulative_counts())
+    ]
+    lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+    return lines
+
+
+def prometheus_text() -> str:
+    """This is used to export the route, pool and cache metrics in the
+    Prometheus text exposition format.
+
+    Returns:
+    --------
+    text: The metrics.
+    """
+    routes = list(route_metrics.items())
+    lines = [
+        "# HELP http_requests_total The number of HTTP requests.",
+        "# TYPE http_requests_total counter",
+    ]
+    for (method, path), metrics in routes:
+        for status_code, count in list(metrics.responses.items()):
+            labels = {"method": method, "route": path, "status": status_code}
+            lines.append(f"http_requests_total{format_labels(labels)} {count}")
+
+    for name, attribute, description in (
+        ("http_request_duration_seconds", "latency", "The request latency."),
+        ("http_request_sql_statements", "sql_statements", "The SQL statements."),
+        ("http_request_sql_duration_seconds", "sql_time", "The time in SQL."),
+    ):
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+        for (method, path), metrics in routes:
+            labels = {"method": method, "route": path}
+            lines += format_histogram(name, labels, getattr(metrics, attribute))
+
+    pools = pool_stats()
+    for stat, kind in (
+        ("size", "gauge"),
+        ("checked_in", "gauge"),
+        ("checked_out", "gauge"),
+        ("overflow", "gauge"),
+        ("checkouts", "counter"),
+        ("checkout_timeouts", "counter"),
+        ("connections_created", "counter"),
+        ("connections_invalidated", "counter"),
+        ("connect_failures", "counter"),
+    ):
+        name = f"db_pool_{stat}" + ("_total" if kind == "counter" else "")
+        lines.append(f"# TYPE {name} {kind}")
+        for pool, stats in pools.items():
+            lines.append(f"{name}{format_labels({'pool': pool})} {stats[stat]}")
+    name = "db_pool_checkout_wait_seconds"
+    lines.append(f"# TYPE {name} histogram")
+    for pool in pools:
+        histogram = pool_metrics[pool].checkout_wait
+        lines += format_histogram(name, {"pool": pool}, histogram)
+
+    caches = cache_stats()
+    for stat, kind in (
+        ("hits", "counter"),
+        ("misses", "counter"),
+        ("evictions", "counter"),
+        ("size", "gauge"),
+    ):
+        name = f"cache_{stat}" + ("_total" if kind == "counter" else "")
+        lines.append(f"# TYPE {name} {kind}")
+        for cache, stats in caches.items():
+            if stat in stats:
+                lines.append(f"{name}{format_labels({'cache': cache})} {stats[stat]}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,97 @@
+from typing import Callable, List, Tuple
+from sqlalchemy import Column, DateTime, MetaData, String, Table, func, inspect
+from sqlalchemy import select, text
+from sqlalchemy.engine import Connection, Engine
+import models
+
+
+# the migrations applied to a database are recorded in this table.
+migrations_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    migrations_metadata,
+    Column("id", String, primary_key=True),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+# the key of the (transaction level) advisory lock taken by `migrate`, so the
+# migrations run once even if several deployments start at the same time.
+MIGRATIONS_LOCK_KEY = 7316209
+
+
+def has_column(conn: Connection, table: str, column: str) -> bool:
+    """This tells whether a table already has a column."""
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+
+def create_tables(conn: Connection) -> None:
+    """This creates the missing tables (with their indexes)."""
+    models.Base.metadata.create_all(bind=conn)
+
+
+def add_vote_count_column(conn: Connection) -> None:
+    """This adds (and backfills) the `vote_count` column of a posts table
+    created before it."""
+    if has_column(conn, "posts", "vote_count"):
+        return
+    conn.execute(
+        text("ALTER TABLE posts ADD COLUMN vote_count INTEGER NOT NULL DEFAULT 0")
+    )
+    conn.execute(
+        text(
+            "UPDATE posts SET vote_count = "
+            "(SELECT count(*) FROM votes WHERE votes.post_id = posts.id)"
+        )
+    )
+
+
+def create_search_index(conn: Connection) -> None:
+    """This creates the full-text search index on a posts table created before
+    it."""
+    if conn.dialect.name == "postgresql":
+        conn.execute(models.CREATE_POSTS_SEARCH_INDEX)
+
+
+def add_version_column(conn: Connection) -> None:
+    """This adds the `version` column to a posts table created before it."""
+    if not has_column(conn, "posts", "version"):
+        conn.execute(
+            text("ALTER TABLE posts ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        )
+
+
+# the migrations, in order. A migration is never edited once it's released: the
+# schema changes are made by appending new ones.
+MIGRATIONS: List[Tuple[str, Callable[[Connection], None]]] = [
+    ("0001_create_tables", create_tables),
+    ("0002_posts_vote_count", add_vote_count_column),
+    ("0003_posts_search_index", create_search_index),
+    ("0004_posts_version", add_version_column),
+]
+
+
+def migrate(engine: Engine) -> List[str]:
+    """This is used to apply the pending migrations, in a single transaction.
+    It's the only place where the schema is changed: the app itself never runs
+    DDL.
+
+    Args:
+    -----
+    engine: The engine of the database to migrate.
+
+    Returns:
+    --------
+    applied: The ids of the migrations applied by this call.
+    """
+    applied = []
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(select(func.pg_advisory_xact_lock(MIGRATIONS_LOCK_KEY))).all()
+        migrations_metadata.create_all(bind=conn)
+        done = set(conn.execute(select(schema_migrations.c.id)).scalars())
+        for migration_id, apply in MIGRATIONS:
+            if migration_id not in done:
+                apply(conn)
+                conn.execute(schema_migrations.insert().values(id=migration_id))
+                applied.append(migration_id)
+    return applied
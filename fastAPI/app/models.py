@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String
+from sqlalchemy import DDL, Boolean, Column, Integer, String, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.expression import text
 from sqlalchemy.sql.schema import ForeignKey
@@ -15,6 +15,10 @@ class Posts(Base):
     title = Column(String, nullable=False, index=True)
     content = Column(String, nullable=False)
     is_published = Column(Boolean, nullable=False, server_default="False")
+    # denormalized number of votes. It's kept in sync by the vote route.
+    vote_count = Column(Integer, nullable=False, server_default="0")
+    # bumped by every update of the post. It's part of the post ETags.
+    version = Column(Integer, nullable=False, server_default="1")
     created_at = Column(
         TIMESTAMP(timezone=True), nullable=False, server_default=text("now()")
     )
@@ -24,6 +28,18 @@ class Posts(Base):
     owner = relationship("Users")  # fetches the owner_id details from the Users table
 
 
+# GIN index used by the Postgres full-text search backend (see search.py).
+CREATE_POSTS_SEARCH_INDEX = DDL(
+    "CREATE INDEX IF NOT EXISTS ix_posts_search ON posts USING GIN "
+    "(to_tsvector('english'::regconfig, title || ' ' || content))"
+)
+event.listen(
+    Posts.__table__,
+    "after_create",
+    CREATE_POSTS_SEARCH_INDEX.execute_if(dialect="postgresql"),
+)
+
+
 class Users(Base):
     """This class is used to create the Users table in the PostgreSQL DB. It
     stores the user information."""
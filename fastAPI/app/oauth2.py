@@ -1,12 +1,18 @@
 from typing import Dict, Optional
 from datetime import datetime, timedelta
+import time
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.session import Session
-from database import get_db
+from database import get_db, get_async_db, async_read_session, read_session
+import invalidation
+import metrics
 import schemas
 import models
+from cache import LRUCache
 from config import settings
 
 # endpoint for logging users in. It automatically logs the user in.
@@ -17,6 +23,13 @@ SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = settings.ALGORITHM
 ACCESS_TOKEN_EXPIRATION_MINUTES = settings.ACCESS_TOKEN_EXPIRATION_MINUTES
 
+# maps recently validated access tokens to the id of their user. A hit skips
+# both the JWT decoding and the users lookup.
+principal_cache = LRUCache(
+    maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL_SECONDS
+)
+metrics.track_cache("principals", principal_cache)
+
 
 def create_access_token(data: Dict, expires_delta: Optional[timedelta] = None) -> str:
     """This is used to create an access token for the user.
@@ -69,6 +82,56 @@ def verify_access_token(
     return token_data
 
 
+def cache_principal(access_token: str, user_id: int) -> None:
+    """This is used to cache the user of a validated access token. The entry
+    never outlives the token itself.
+
+    Args:
+    -----
+    access_token: The validated access token.
+    user_id: The ID of the user the token belongs to.
+
+    Returns:
+    --------
+    None
+    """
+    ttl = settings.AUTH_CACHE_TTL_SECONDS
+    expire = jwt.get_unverified_claims(access_token).get("exp")
+    if expire is not None:
+        ttl = min(ttl, expire - time.time())
+    if ttl > 0:
+        principal_cache.set(access_token, user_id, ttl=ttl)
+
+
+def invalidate_user(user_id: int) -> int:
+    """This is used to drop the cached access tokens of a user. It must be called
+    whenever a user is deleted (ORM deletes do it automatically).
+
+    Args:
+    -----
+    user_id: The ID of the deleted user.
+
+    Returns:
+    --------
+    num_deleted: The number of cached access tokens that were dropped.
+    """
+    return principal_cache.delete_matching(
+        lambda _, cached_user_id: cached_user_id == user_id
+    )
+
+
+@event.listens_for(models.Users, "after_delete")
+def invalidate_deleted_user(mapper, connection, target) -> None:
+    """This drops the cached access tokens of a user deleted through the ORM
+    (and tells the other workers to do the same at commit)."""
+    invalidate_user(target.id)
+    invalidation.notify(connection, "user", [target.id])
+
+
+# the tokens of a user deleted by another worker are dropped too
+invalidation.register("user", invalidate_user, principal_cache.clear)
+
+
 def get_current_user(
     access_token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
 ):
@@ -82,6 +145,11 @@ def get_current_user(
     --------
     user_id: The ID of the logged in user.
     """
+    user_id = principal_cache.get(access_token)
+    if user_id is not None:
+        db.info["user_id"] = user_id  # see `database.record_write`
+        return user_id
+
     credentials_exception: str = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials!",
@@ -95,4 +163,70 @@ def get_current_user(
             status_code=status.HTTP_404_NOT_FOUND, detail="Incorrect user_id!"
         )
     user_id = query_result.id
+    cache_principal(access_token, user_id)
+    db.info["user_id"] = user_id
+    return user_id
+
+
+async def get_current_user_async(
+    access_token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)
+):
+    """This is the async version of `get_current_user`.
+
+    Args:
+    -----
+    access_token: The access token which must be used before a user can login.
+
+    Returns:
+    --------
+    user_id: The ID of the logged in user.
+    """
+    user_id = principal_cache.get(access_token)
+    if user_id is not None:
+        db.info["user_id"] = user_id  # see `database.record_write`
+        return user_id
+
+    credentials_exception: str = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials!",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    payload = verify_access_token(access_token, credentials_exception)
+    query_result = await db.get(models.Users, int(payload.id))
+
+    if not query_result:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Incorrect user_id!"
+        )
+    user_id = query_result.id
+    cache_principal(access_token, user_id)
+    db.info["user_id"] = user_id
     return user_id
+
+
+def get_read_db(current_user: int = Depends(get_current_user)):
+    """This creates the database session of a read-only request of the logged in
+    user: on a read replica, unless the user wrote recently (read-your-writes).
+
+    Args:
+    -----
+    current_user: The ID of the logged in user.
+
+    Returns:
+    --------
+    db: The database session.
+    """
+    db = read_session(current_user)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_read_db_async(current_user: int = Depends(get_current_user_async)):
+    """This is the async version of `get_read_db`."""
+    db = await async_read_session(current_user)
+    try:
+        yield db
+    finally:
+        await db.close()
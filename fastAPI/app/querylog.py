@@ -0,0 +1,153 @@
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import metrics
+from config import settings
+
+
+# the slow statements are logged through a queue, so the (blocking) output is
+# written by the listener thread instead of the request threads.
+log_queue: queue.Queue = queue.Queue(-1)
+logger = logging.getLogger("app.slow_queries")
+logger.setLevel(logging.WARNING)
+logger.addHandler(QueueHandler(log_queue))
+logger.propagate = False
+
+listener: Optional[QueueListener] = None
+
+
+class JSONFormatter(logging.Formatter):
+    """This formats a slow statement log record as a JSON line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"time": self.formatTime(record), "event": record.getMessage()}
+        entry.update(getattr(record, "slow_query", {}))
+        return json.dumps(entry, default=str)
+
+
+def start_listener() -> None:
+    """This starts the thread writing the slow statement logs to stderr."""
+    global listener
+    if listener is None:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JSONFormatter())
+        listener = QueueListener(log_queue, handler)
+        listener.start()
+
+
+def stop_listener() -> None:
+    """This writes the pending slow statement logs and stops the thread."""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+def explain(conn, statement: str, parameters) -> List[Dict]:
+    """This is used to get the plan of a statement with EXPLAIN (ANALYZE,
+    BUFFERS). The statement is run again, in the same transaction (within a
+    savepoint, so an error doesn't abort it), on another cursor (so the results
+    of the statement are left untouched).
+
+    Args:
+    -----
+    conn: The connection which executed the statement.
+    statement: The SQL of the statement (a SELECT).
+    parameters: Its DBAPI parameters.
+
+    Returns:
+    --------
+    plan: The JSON plan.
+    """
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            cursor.execute(
+                "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters
+            )
+            plan = cursor.fetchone()[0]
+        finally:
+            cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+    finally:
+        cursor.close()
+    return json.loads(plan) if isinstance(plan, str) else plan
+
+
+def can_explain(conn, statement: str, context, executemany: bool) -> bool:
+    """This tells whether the plan of a slow statement can be captured: only
+    single Postgres SELECTs are run again (not DML, nor streamed results)."""
+    return (
+        conn.dialect.name == "postgresql"
+        and not executemany
+        and statement.lstrip()[:6].upper() == "SELECT"
+        and not (context and context.execution_options.get("stream_results"))
+    )
+
+
+def measure(context, statement: str, many: bool) -> Optional[Dict]:
+    """This returns the log entry of a statement which just ended, if it was
+    slow (None otherwise)."""
+    start = getattr(context, "slow_query_start", None)
+    if start is None:
+        return None
+    duration_ms = (time.perf_counter() - start) * 1000
+    if duration_ms < settings.SLOW_QUERY_THRESHOLD_MS:
+        return None
+    return {
+        "duration_ms": round(duration_ms, 3),
+        "route": metrics.current_route(),
+        "statement": statement,
+        "executemany": many,
+    }
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    """This stores the start time of a statement on its execution context (so
+    nothing is left behind when it fails)."""
+    if context is not None:
+        context.slow_query_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    """This logs the statement if it took longer than SLOW_QUERY_THRESHOLD_MS,
+    with its plan for a sample of them (SLOW_QUERY_EXPLAIN_RATE)."""
+    slow_query = measure(context, statement, many)
+    if slow_query is None:
+        return
+    if random.random() < settings.SLOW_QUERY_EXPLAIN_RATE and can_explain(
+        conn, statement, context, many
+    ):
+        try:
+            slow_query["plan"] = explain(conn, statement, parameters)
+        except Exception as e:
+            slow_query["plan_error"] = repr(e)
+    logger.warning("slow query", extra={"slow_query": slow_query})
+
+
+def handle_error(exception_context) -> None:
+    """This logs a statement which failed after running for too long (e.g. it
+    was cancelled by a statement timeout)."""
+    slow_query = measure(
+        exception_context.execution_context, exception_context.statement, False
+    )
+    if slow_query is not None:
+        slow_query["error"] = repr(exception_context.original_exception)
+        logger.warning("slow query", extra={"slow_query": slow_query})
+
+
+def track_slow_queries() -> None:
+    """This is used to log the slow statements of every engine (sync and
+    async). A negative SLOW_QUERY_THRESHOLD_MS disables it."""
+    if settings.SLOW_QUERY_THRESHOLD_MS >= 0:
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(Engine, "handle_error", handle_error)
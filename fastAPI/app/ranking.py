@@ -0,0 +1,239 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from bisect import bisect_left, insort
+from datetime import datetime, timezone
+import logging
+import math
+import threading
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from config import settings
+import database
+import models
+
+logger = logging.getLogger("app.ranking")
+
+# the number of seconds after which a post needs twice the votes to rank like a
+# newer post, in the trending ranking.
+TRENDING_GRAVITY_SECONDS = settings.TRENDING_GRAVITY_HOURS * 3600
+
+# the delay before retrying a failed build of the rankings (seconds)
+RETRY_SECONDS = 5
+
+
+def top_score(votes: int, created_at: datetime) -> float:
+    """This is the score of a post in the top ranking: its number of votes."""
+    return votes
+
+
+def trending_score(votes: int, created_at: datetime) -> float:
+    """This is the score of a post in the trending ranking. The votes count on a
+    log scale and the newer posts get a bonus, instead of the older posts
+    decaying, so the score of a post only changes when it's voted on and the
+    ranking can be maintained incrementally."""
+    return math.log2(1 + votes) + created_at.timestamp() / TRENDING_GRAVITY_SECONDS
+
+
+# the same scores, as SQL expressions (to load the best posts)
+top_score_sql = models.Posts.vote_count
+trending_score_sql = (
+    func.ln(1 + models.Posts.vote_count) / math.log(2)
+    + func.extract("epoch", models.Posts.created_at) / TRENDING_GRAVITY_SECONDS
+)
+
+
+class Ranking:
+    """This is an in-process ranking of the best posts, kept sorted by score as
+    the votes arrive (the best post first). Only the `size` best posts are kept,
+    so the last ones are approximate: a post voted out of the ranking isn't
+    replaced by the next best one until the ranking is rebuilt.
+
+    Args:
+    -----
+    score: The score of a post, from its number of votes and creation date.
+    score_sql: The same score, as an SQL expression over the posts table.
+    size: The maximum number of posts.
+    """
+
+    def __init__(
+        self, score: Callable[[int, datetime], float], score_sql, size: int
+    ) -> None:
+        self.score = score
+        self.score_sql = score_sql
+        self.size = size
+        self._lock = threading.Lock()
+        self._keys: Dict[int, Tuple[float, int]] = {}  # post id -> sort key
+        self._sorted: List[Tuple[float, int]] = []
+
+    def update_post(self, post_id: int, votes: int, created_at: datetime) -> None:
+        """This is used to add/move a post after it was created or voted on."""
+        key = (-self.score(votes, created_at), post_id)
+        if self._keys.get(post_id) == key:
+            return  # its rank didn't change
+        with self._lock:
+            if post_id not in self._keys and len(self._sorted) >= self.size:
+                if not self._sorted or key >= self._sorted[-1]:
+                    return  # not good enough to enter the ranking
+            self._remove(post_id)
+            self._keys[post_id] = key
+            insort(self._sorted, key)
+            if len(self._sorted) > self.size:
+                _, last_post_id = self._sorted.pop()
+                del self._keys[last_post_id]
+
+    def remove_post(self, post_id: int) -> None:
+        """This is used to remove a deleted post from the ranking."""
+        with self._lock:
+            self._remove(post_id)
+
+    def _remove(self, post_id: int) -> None:
+        """This removes a post from the ranking. The lock must be held."""
+        key = self._keys.pop(post_id, None)
+        if key is not None:
+            del self._sorted[bisect_left(self._sorted, key)]
+
+    def load(self, db: Session) -> List[Tuple[int, int, datetime]]:
+        """This is used to load the best posts from the database.
+
+        Returns:
+        --------
+        posts: The (id, vote count, creation date) of the `size` best posts.
+        """
+        return (
+            db.query(models.Posts.id, models.Posts.vote_count, models.Posts.created_at)
+            .order_by(self.score_sql.desc(), models.Posts.id)
+            .limit(self.size)
+            .all()
+        )
+
+    def replace(self, posts: Iterable[Tuple[int, int, datetime]]) -> None:
+        """This is used to replace the whole ranking.
+
+        Args:
+        -----
+        posts: The (id, vote count, creation date) of the best posts.
+        """
+        keys = {
+            id: (-self.score(votes, created_at), id) for id, votes, created_at in posts
+        }
+        ranked = sorted(keys.values())[: self.size]
+        with self._lock:
+            self._keys = {key[1]: key for key in ranked}
+            self._sorted = ranked
+
+    def page(self, skip: int, limit: int) -> List[int]:
+        """This returns the ids of the posts ranked skip + 1 to skip + limit."""
+        with self._lock:
+            return [post_id for _, post_id in self._sorted[skip : skip + limit]]
+
+
+# the rankings served by GET /posts/top and GET /posts/trending.
+top = Ranking(top_score, top_score_sql, settings.RANKING_SIZE)
+trending = Ranking(trending_score, trending_score_sql, settings.RANKING_SIZE)
+rankings = (top, trending)
+
+# set once the rankings were loaded from the database
+built = threading.Event()
+
+# the changes made while the rankings are rebuilt, applied again over the
+# (older) rows of the rebuild. None when no rebuild is running.
+_changes: Optional[List[Tuple]] = None
+_changes_lock = threading.Lock()
+
+_stopping = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def update_post(post_id: int, votes: int, created_at: Optional[datetime]) -> None:
+    """This is used to update the rankings with the vote count of a post, after
+    it was created or voted on.
+
+    Args:
+    -----
+    post_id: The ID of the post.
+    votes: Its (committed) number of votes.
+    created_at: Its creation date (now, if the database didn't return it).
+
+    Returns:
+    --------
+    None
+    """
+    created_at = created_at or datetime.now(timezone.utc)
+    with _changes_lock:
+        if _changes is not None:
+            _changes.append((post_id, votes, created_at))
+    for ranking in rankings:
+        ranking.update_post(post_id, votes, created_at)
+
+
+def remove_post(post_id: int) -> None:
+    """This is used to remove a deleted post from the rankings."""
+    with _changes_lock:
+        if _changes is not None:
+            _changes.append((post_id, None, None))
+    for ranking in rankings:
+        ranking.remove_post(post_id)
+
+
+def rebuild() -> None:
+    """This is used to reload the rankings from the posts table (on the
+    primary). It catches up with the posts created, deleted and voted on by
+    the other workers."""
+    global _changes
+    with _changes_lock:
+        _changes = []
+    try:
+        db = database.SessionLocal()
+        try:
+            loaded = [(ranking, ranking.load(db)) for ranking in rankings]
+        finally:
+            db.close()
+        with _changes_lock:
+            for ranking, posts in loaded:
+                ranking.replace(posts)
+            for post_id, votes, created_at in _changes:
+                for ranking in rankings:
+                    if votes is None:
+                        ranking.remove_post(post_id)
+                    else:
+                        ranking.update_post(post_id, votes, created_at)
+    finally:
+        with _changes_lock:
+            _changes = None
+
+
+def _run() -> None:
+    while not _stopping.is_set():
+        try:
+            rebuild()
+            built.set()
+        except Exception:
+            logger.exception("The rankings couldn't be loaded.")
+            _stopping.wait(RETRY_SECONDS)
+            continue
+        if settings.RANKING_REBUILD_SECONDS <= 0:
+            return
+        _stopping.wait(settings.RANKING_REBUILD_SECONDS)
+
+
+def start() -> None:
+    """This starts the thread loading the rankings, then reloading them every
+    RANKING_REBUILD_SECONDS (0 = never)."""
+    global _thread
+    _stopping.clear()
+    _thread = threading.Thread(target=_run, name="rankings", daemon=True)
+    _thread.start()
+
+
+def stop() -> None:
+    """This stops the thread (once its current rebuild is done)."""
+    global _thread
+    if _thread is not None:
+        _stopping.set()
+        _thread.join()
+        _thread = None
+
+
+def is_built() -> bool:
+    """This tells whether the rankings are loaded, without waiting for them (the
+    first load runs in the background at startup)."""
+    return built.is_set()
@@ -0,0 +1,182 @@
+from typing import AsyncIterator, Dict, Optional
+import asyncio
+from fastapi import APIRouter, Header, WebSocket, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+import orjson
+
+from config import settings
+import broadcast, database, models, oauth2, utils, votebuffer
+
+# the paths are absolute: the router prefix isn't applied to the WebSocket routes
+# (FastAPI 0.70).
+router = APIRouter(tags=["Live"])
+# the live routes open their own (sync) sessions, so they are the same in async
+# mode
+async_router = router
+
+
+def bearer_token(authorization: Optional[str], token: Optional[str]) -> str:
+    """This returns the access token of a live request: the `token` query
+    parameter (browsers can't set headers on WebSockets and EventSources) or
+    the Authorization header."""
+    if token:
+        return token
+    scheme, _, credentials = (authorization or "").partition(" ")
+    return credentials if scheme.lower() == "bearer" else ""
+
+
+def load_votes(id: int, access_token: str) -> Dict:
+    """This is used to authenticate a subscriber and load the current vote count
+    of the post it follows.
+
+    Args:
+    -----
+    id: The id of the post.
+    access_token: The access token of the user.
+
+    Returns:
+    --------
+    message: The first message sent to the subscriber (a "votes" event).
+    """
+    db = database.SessionLocal()
+    try:
+        current_user = oauth2.get_current_user(access_token=access_token, db=db)
+    finally:
+        db.close()
+
+    db = database.read_session(current_user)
+    try:
+        query_result = (
+            db.query(models.Posts.id, votebuffer.votes_column())
+            .filter(models.Posts.id == id)
+            .first()
+        )
+    finally:
+        db.close()
+    if not query_result:
+        utils.error_msg(id)
+    return {"event": "votes", "post_id": id, "votes": query_result.votes, "delta": 0}
+
+
+@router.get("/posts/{id}/live")
+async def live_post_events(
+    id: int,
+    token: Optional[str] = None,
+    authorization: Optional[str] = Header(None),
+) -> StreamingResponse:
+    """This is used to follow the vote count of a post with server-sent events
+    (the fallback of the WebSocket of the same path).
+
+    Args:
+    -----
+    id: The id of the post.
+    token: The access token, when it can't be sent in the Authorization header.
+
+    Returns:
+    --------
+    event_stream: A "votes" event with the current count, then one per update
+    (`delta` is the change since the previous event) and a "deleted" event if
+    the post is deleted.
+    """
+    access_token = bearer_token(authorization, token)
+    subscriber = broadcast.broadcaster.subscribe(id)
+    try:
+        first_message = await run_in_threadpool(load_votes, id, access_token)
+    except BaseException:
+        broadcast.broadcaster.unsubscribe(id, subscriber)
+        raise
+
+    async def events() -> AsyncIterator[bytes]:
+        try:
+            yield format_event(first_message)
+            async for messages in broadcast.follow(subscriber):
+                if not messages:
+                    yield b": keep-alive\n\n"
+                for message in messages:
+                    yield format_event(message)
+                    if message["event"] == "deleted":
+                        return
+        except broadcast.SlowConsumer:
+            return
+        finally:
+            broadcast.broadcaster.unsubscribe(id, subscriber)
+
+    event_stream = StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    return event_stream
+
+
+def format_event(message: Dict) -> bytes:
+    """This is used to serialize a message as a server-sent event."""
+    return b"event: %s\ndata: %s\n\n" % (
+        message["event"].encode(),
+        orjson.dumps(message),
+    )
+
+
+@router.websocket("/posts/{id}/live")
+async def live_post(websocket: WebSocket, id: int, token: Optional[str] = None):
+    """This is used to follow the vote count of a post over a WebSocket. The
+    messages are the same as the ones of the server-sent events, as JSON text
+    frames. A subscriber too slow to keep up is disconnected (code 1013).
+
+    Args:
+    -----
+    id: The id of the post.
+    token: The access token, when it can't be sent in the Authorization header.
+    """
+    access_token = bearer_token(websocket.headers.get("authorization"), token)
+    subscriber = broadcast.broadcaster.subscribe(id)
+    try:
+        try:
+            first_message = await run_in_threadpool(load_votes, id, access_token)
+        except Exception:  # not logged in or no such post
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        await websocket.accept()
+
+        sender = asyncio.ensure_future(
+            send_updates(websocket, subscriber, first_message)
+        )
+        receiver = asyncio.ensure_future(wait_for_disconnect(websocket))
+        done, _ = await asyncio.wait(
+            {sender, receiver}, return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in (sender, receiver):
+            task.cancel()
+        if sender in done and not sender.cancelled():
+            error = sender.exception()
+            if error is None:  # the post was deleted
+                await websocket.close()
+            elif isinstance(error, (broadcast.SlowConsumer, asyncio.TimeoutError)):
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+            else:
+                raise error
+    finally:
+        broadcast.broadcaster.unsubscribe(id, subscriber)
+
+
+async def send_updates(
+    websocket: WebSocket, subscriber: broadcast.Subscriber, first_message: Dict
+) -> None:
+    """This sends the messages of a subscriber until its post is deleted."""
+    timeout = settings.LIVE_SEND_TIMEOUT_SECONDS
+    await asyncio.wait_for(
+        websocket.send_text(orjson.dumps(first_message).decode()), timeout
+    )
+    async for messages in broadcast.follow(subscriber):
+        for message in messages:
+            text = orjson.dumps(message).decode()
+            await asyncio.wait_for(websocket.send_text(text), timeout)
+            if message["event"] == "deleted":
+                return
+
+
+async def wait_for_disconnect(websocket: WebSocket) -> None:
+    """This reads (and ignores) the messages of a client until it disconnects."""
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
@@ -1,20 +1,16 @@
 from fastapi import APIRouter, Depends, status, HTTPException
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import Dict
-import sys
-import os
 
-curr_dir = os.path.dirname(__file__)
-top_dir = os.path.abspath(os.path.join(curr_dir, ".."))
-
-# insert top_dir into system path
-sys.path.insert(0, top_dir)
-
-from database import get_db
+from database import get_db, get_async_db
 import models, schemas, utils, oauth2
 
 router = APIRouter(prefix="/login", tags=["Authentication"])
+# used instead of `router` when settings.DATABASE_ASYNC is enabled
+async_router = APIRouter(prefix="/login", tags=["Authentication"])
 
 
 @router.post("", status_code=status.HTTP_200_OK, response_model=schemas.TokenResponse)
@@ -49,11 +45,65 @@ def authenticate_user(
         )
 
     # verify the password
-    if not utils.verify_password(form_data.password, query_result.password):
+    password_ok, new_hash = utils.run_hashing(
+        utils.verify_and_update_password, form_data.password, query_result.password
+    )
+    if not password_ok:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Invalid credentials!",
+        )
+    if new_hash:  # the password was hashed with an outdated cost factor
+        query_result.password = new_hash
+        db.commit()
+
+    payload = {"user_id": query_result.id}
+    # create tokem
+    jwt_access_token = oauth2.create_access_token(data=payload)
+    login_cred = {"access_token": jwt_access_token, "token_type": "bearer"}
+
+    return login_cred
+
+
+@async_router.post(
+    "", status_code=status.HTTP_200_OK, response_model=schemas.TokenResponse
+)
+async def authenticate_user_async(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_async_db),
+) -> Dict:
+    """This is the async version of `authenticate_user`.
+
+    Args:
+    -----
+    form_data: The user credentials.
+
+    Returns:
+    --------
+    login_cred: The login credentials.
+    """
+    # attempt by the user to login
+    my_query = select(models.Users).filter(models.Users.email == form_data.username)
+
+    query_result = (await db.execute(my_query)).scalars().first()
+    if not query_result:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Invalid credentials!",
+        )
+
+    # verify the password
+    password_ok, new_hash = await utils.run_hashing_async(
+        utils.verify_and_update_password, form_data.password, query_result.password
+    )
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail=f"Invalid credentials!",
         )
+    if new_hash:  # the password was hashed with an outdated cost factor
+        query_result.password = new_hash
+        await db.commit()
 
     payload = {"user_id": query_result.id}
     # create tokem
@@ -0,0 +1,90 @@
+from typing import Dict
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+import broadcast
+import invalidation
+import metrics
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+# the metrics don't use the database, so the same routes are used in async mode
+async_router = router
+
+
+@router.get("", response_class=PlainTextResponse)
+def get_metrics() -> PlainTextResponse:
+    """This is used to scrape the route, pool and cache metrics (Prometheus text
+    format).
+
+    Returns:
+    --------
+    metrics_response: The metrics.
+    """
+    metrics_response = PlainTextResponse(
+        metrics.prometheus_text(), media_type="text/plain; version=0.0.4"
+    )
+    return metrics_response
+
+
+@router.get("/routes")
+def get_route_stats() -> Dict[str, Dict]:
+    """This is used to get the latency, status codes and SQL statements per
+    request of each route.
+
+    Returns:
+    --------
+    route_stats: The statistics per route ("METHOD /path/template").
+    """
+    route_stats = metrics.route_stats()
+    return route_stats
+
+
+@router.get("/pool")
+def get_pool_stats() -> Dict[str, Dict]:
+    """This is used to get the live statistics of the connection pools (e.g. to
+    size them against the number of workers).
+
+    Returns:
+    --------
+    pool_stats: The statistics per pool ("primary", and "async" if enabled).
+    """
+    pool_stats = metrics.pool_stats()
+    return pool_stats
+
+
+@router.get("/caches")
+def get_cache_stats() -> Dict[str, Dict]:
+    """This is used to get the hit/miss/eviction counters of the caches.
+
+    Returns:
+    --------
+    cache_stats: The statistics per cache ("posts", "principals").
+    """
+    cache_stats = metrics.cache_stats()
+    return cache_stats
+
+
+@router.get("/live")
+def get_live_stats() -> Dict[str, int]:
+    """This is used to get the number of live subscribers and followed posts of
+    the worker, and how many updates were published, queued, coalesced and
+    dropped (slow subscribers).
+
+    Returns:
+    --------
+    live_stats: The statistics of the broadcaster.
+    """
+    return broadcast.broadcaster.stats()
+
+
+@router.get("/invalidation")
+def get_invalidation_stats() -> Dict[str, int]:
+    """This is used to check the cache invalidation listener of the worker:
+    whether it's connected, and how many notifications it received, how often it
+    reconnected and flushed the caches.
+
+    Returns:
+    --------
+    invalidation_stats: The statistics of the listener.
+    """
+    return invalidation.listener.stats()
@@ -1,20 +1,21 @@
 from typing import List, Dict, Optional
-from fastapi import HTTPException, Response, status, Depends, APIRouter
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-import os
-import sys
+from fastapi import Header, HTTPException, Query, Request, Response, status, Depends
+from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
+import orjson
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased, joinedload
 
-curr_dir = os.path.dirname(__file__)
-top_dir = os.path.abspath(os.path.join(curr_dir, ".."))
-
-# insert top_dir into system path
-sys.path.insert(0, top_dir)
-
-from database import get_db
-import models, schemas, utils, oauth2
+from config import settings
+from database import get_db, get_async_db
+import cache, ingest, models, ranking, schemas, serializers, utils, oauth2
+import broadcast, invalidation, votebuffer
+import search as search_index  # `search` is also a query parameter of get_posts
 
 router = APIRouter(prefix="/posts", tags=["Posts"])
+# used instead of `router` when settings.DATABASE_ASYNC is enabled
+async_router = APIRouter(prefix="/posts", tags=["Posts"])
 
 
 @router.post(
@@ -41,67 +42,353 @@ def create_post(
     db.add(new_post)
     db.commit()
     db.refresh(new_post)  # used to return the newly created data to the frontend
+    search_index.backend.index_post(new_post)
+    ranking.update_post(new_post.id, new_post.vote_count, new_post.created_at)
 
     return new_post
 
 
+def index_bulk_posts(post_ids: List[int], posts: List[schemas.PostCreate]) -> None:
+    """This is used to add the posts of a bulk upload to the search index and to
+    the rankings.
+
+    Args:
+    -----
+    post_ids: The ids of the inserted posts.
+    posts: The inserted posts.
+
+    Returns:
+    --------
+    None
+    """
+    for post_id, post in zip(post_ids, posts):
+        search_index.backend.index_post(models.Posts(id=post_id, **post.dict()))
+        ranking.update_post(post_id, 0, None)
+
+
+@router.post(
+    "/bulk",
+    status_code=status.HTTP_201_CREATED,
+    response_model=schemas.BulkPostResponse,
+)
+async def bulk_create_posts(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: int = Depends(oauth2.get_current_user),
+) -> Dict:
+    """This is used to create many posts at once (e.g. a backfill). The body is
+    streamed, validated line by line and inserted in chunks with COPY.
+
+    Args:
+    -----
+    request: The upload, as NDJSON (Content-Type: application/x-ndjson) or CSV
+    with a header (Content-Type: text/csv). Every line/record is a PostCreate.
+
+    Returns:
+    --------
+    bulk_result: The ids of the inserted posts and the invalid lines.
+    """
+
+    async def insert_chunk(posts: List[schemas.PostCreate]) -> List[int]:
+        post_ids = await run_in_threadpool(ingest.insert_posts, db, posts, current_user)
+        index_bulk_posts(post_ids, posts)
+        return post_ids
+
+    media_type = request.headers.get("content-type", "").split(";")[0].strip()
+    return await ingest.bulk_insert(request.stream(), media_type, insert_chunk)
+
+
 @router.get("/", response_model=List[schemas.PostResponse2])
 def get_posts(
-    db: Session = Depends(get_db),
+    response: Response,
+    db: Session = Depends(oauth2.get_read_db),
     _: int = Depends(oauth2.get_current_user),
     limit: int = 10,
     skip: int = 0,
     search: Optional[str] = "",
+    rank: bool = False,
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
 ) -> List[Dict]:
     """This is used to load all the posts in the database.
 
+    Args:
+    -----
+    search: Only return the posts whose title or content match these words.
+    rank: Order the matching posts by relevance instead of by id. It's paginated
+    with `skip`.
+    cursor: An opaque cursor returned in the `X-Next-Cursor` header of the
+    previous page. When it's given, `skip` is ignored and the page starts right
+    after the last post seen (keyset pagination).
+    if_none_match: The ETag of a previous response. A 304 is returned when none
+    of the posts of the page changed.
+
     Returns:
     --------
     all_posts: All the posts stored in the database.
     """
-    # SELECT * FROM posts
-    all_posts = (
-        db.query(models.Posts, func.count(models.Votes.post_id).label("votes"))
-        .join(models.Votes, models.Posts.id == models.Votes.post_id, isouter=True)
-        .filter(models.Posts.title.contains(search))
-        .group_by(models.Posts.id)
+    # SELECT * FROM posts. The owners are loaded in the same statement (JOIN)
+    # instead of one lazy load per post.
+    my_query = db.query(models.Posts, votebuffer.votes_column()).options(
+        joinedload(models.Posts.owner)
+    )
+    if search:
+        my_query = search_index.backend.filter(my_query, search)
+    if search and rank:
+        relevance = search_index.backend.rank(search)
+        all_posts = (
+            my_query.order_by(relevance.desc(), models.Posts.id)
+            .limit(limit)
+            .offset(skip)
+            .all()
+        )
+    else:
+        my_query = my_query.order_by(models.Posts.id)
+        if cursor:
+            # seek through the primary key index instead of scanning `skip` rows
+            my_query = my_query.filter(models.Posts.id > utils.decode_cursor(cursor))
+        else:
+            my_query = my_query.offset(skip)
+        all_posts = my_query.limit(limit).all()
+
+        if all_posts and len(all_posts) == limit:
+            next_cursor = utils.encode_cursor(all_posts[-1].Posts.id)
+            response.headers["X-Next-Cursor"] = next_cursor
+
+    # the ETag is made of the versions of the posts, so the page is serialized
+    # only when one of them changed.
+    etag = utils.make_etag(
+        [(row.Posts.id, row.Posts.version, row.votes) for row in all_posts]
+    )
+    if utils.etag_matches(if_none_match, etag):
+        return utils.not_modified(etag, dict(response.headers))
+    response.headers["ETag"] = etag
+
+    if settings.FAST_JSON:
+        return serializers.fast_json_response(
+            serializers.project_post_with_votes, all_posts, response
+        )
+    return all_posts  # FastAPI automatically serializes the data.
+
+
+@router.get("/export", response_model=List[schemas.PostResponse2])
+def export_posts(
+    db: Session = Depends(oauth2.get_read_db),
+    _: int = Depends(oauth2.get_current_user),
+    export_format: schemas.ExportFormat = Query(
+        schemas.ExportFormat.ndjson, alias="format"
+    ),
+):
+    """This is used to export all the posts (with their votes). They are streamed
+    from a server-side cursor, so the memory use doesn't grow with the table.
+
+    Args:
+    -----
+    export_format: "ndjson" (one post per line) or "json" (a JSON array).
+
+    Returns:
+    --------
+    streaming_response: The streamed posts.
+    """
+    my_query = (
+        db.query(models.Posts, votebuffer.votes_column())
+        .options(joinedload(models.Posts.owner))
         .order_by(models.Posts.id)
-        .limit(limit)
-        .offset(skip)
+        .yield_per(serializers.EXPORT_CHUNK_SIZE)
+    )
+    return serializers.export_response(
+        serializers.project_post_with_votes, my_query, export_format
+    )
+
+
+def get_ranked_posts(
+    ranked: ranking.Ranking,
+    response: Response,
+    db: Session,
+    limit: int,
+    skip: int,
+    if_none_match: Optional[str],
+) -> List[Dict]:
+    """This is used to load a page of a ranking of the posts. The ranking only
+    gives the ids, so no sort over the posts table is needed.
+
+    Args:
+    -----
+    ranked: The ranking (ranking.top or ranking.trending).
+    limit: The number of posts of the page.
+    skip: The number of better ranked posts to skip.
+    if_none_match: The ETag of a previous response. A 304 is returned when the
+    page didn't change.
+
+    Returns:
+    --------
+    ranked_posts: The posts of the page, best first.
+    """
+    if not ranking.is_built():  # don't hold the worker while they load
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The rankings are being loaded. Try again later.",
+        )
+    post_ids = ranked.page(skip, limit)
+    rows = (
+        db.query(models.Posts, votebuffer.votes_column())
+        .options(joinedload(models.Posts.owner))
+        .filter(models.Posts.id.in_(post_ids))
         .all()
     )
+    rows_by_id = {row.Posts.id: row for row in rows}
+    # the rankings aren't changed here: the session may be on a lagging replica
+    # (a post missing from it may only be too new).
+    ranked_posts = [rows_by_id[id] for id in post_ids if id in rows_by_id]
 
-    return all_posts  # FastAPI automatically serializes the data.
+    etag = utils.make_etag(
+        [(row.Posts.id, row.Posts.version, row.votes) for row in ranked_posts]
+    )
+    if utils.etag_matches(if_none_match, etag):
+        return utils.not_modified(etag)
+    response.headers["ETag"] = etag
+
+    if settings.FAST_JSON:
+        return serializers.fast_json_response(
+            serializers.project_post_with_votes, ranked_posts, response
+        )
+    return ranked_posts
+
+
+@router.get("/top", response_model=List[schemas.PostResponse2])
+def get_top_posts(
+    response: Response,
+    db: Session = Depends(oauth2.get_read_db),
+    _: int = Depends(oauth2.get_current_user),
+    limit: int = 10,
+    skip: int = 0,
+    if_none_match: Optional[str] = Header(None),
+) -> List[Dict]:
+    """This is used to load the most voted posts.
+
+    Args:
+    -----
+    limit: The number of posts.
+    skip: The number of more voted posts to skip.
+    if_none_match: The ETag of a previous response.
+
+    Returns:
+    --------
+    top_posts: The posts, the most voted first.
+    """
+    return get_ranked_posts(ranking.top, response, db, limit, skip, if_none_match)
+
+
+@router.get("/trending", response_model=List[schemas.PostResponse2])
+def get_trending_posts(
+    response: Response,
+    db: Session = Depends(oauth2.get_read_db),
+    _: int = Depends(oauth2.get_current_user),
+    limit: int = 10,
+    skip: int = 0,
+    if_none_match: Optional[str] = Header(None),
+) -> List[Dict]:
+    """This is used to load the trending posts: the most voted ones, a post
+    needing twice the votes of a post TRENDING_GRAVITY_HOURS newer.
+
+    Args:
+    -----
+    limit: The number of posts.
+    skip: The number of more trending posts to skip.
+    if_none_match: The ETag of a previous response.
+
+    Returns:
+    --------
+    trending_posts: The posts, the most trending first.
+    """
+    return get_ranked_posts(ranking.trending, response, db, limit, skip, if_none_match)
 
 
 @router.get("/{id}", response_model=schemas.PostResponse2)
 def get_post(
     id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(oauth2.get_read_db),
     _: int = Depends(oauth2.get_current_user),
+    if_none_match: Optional[str] = Header(None),
 ) -> Dict:
-    """This is used to retrieve a single post using a unique post id.
+    """This is used to retrieve a single post using a unique post id. The JSON
+    of the post (and its ETag) is cached (read-through) until the post changes.
+    A GET which loaded the post before a change can't cache its copy (see
+    `cache.evict_post`).
     Args:
     -----
     id: The id of the post to be retrieved.
+    if_none_match: The ETag of a previous response. A 304 is returned when the
+    post didn't change.
 
     Returns:
     --------
-    query_result: The retrieved post.
+    json_response: The retrieved post.
     """
-    my_query = (
-        db.query(models.Posts, func.count(models.Votes.post_id).label("votes"))
-        .join(models.Votes, models.Posts.id == models.Votes.post_id, isouter=True)
-        .filter(models.Posts.id == id)
-        .group_by(models.Posts.id)
+    cached_post = cache.post_cache.get(id)
+    if cached_post is None:
+        if if_none_match:
+            # compare the versions before loading (and serializing) the post
+            versions = (
+                db.query(models.Posts.version, votebuffer.votes_column())
+                .filter(models.Posts.id == id)
+                .first()
+            )
+            if versions:
+                etag = utils.make_etag("post", id, *versions)
+                if utils.etag_matches(if_none_match, etag):
+                    return utils.not_modified(etag)
+
+        query_result = (
+            db.query(models.Posts, votebuffer.votes_column())
+            .options(joinedload(models.Posts.owner))
+            .filter(models.Posts.id == id)
+            .first()
+        )
+
+        if not query_result:
+            utils.error_msg(id)
+
+        etag = utils.make_etag(
+            "post", id, query_result.Posts.version, query_result.votes
+        )
+        body = orjson.dumps(serializers.project_post_with_votes(query_result))
+        cached_post = (etag, body)
+        ttl = None
+        if db.info.get("replica"):
+            # a lagging replica may have missed the write that invalidated the
+            # entry, so its copy is only kept for the replication lag window
+            ttl = min(
+                settings.POST_CACHE_TTL_SECONDS, settings.READ_YOUR_WRITES_SECONDS
+            )
+        cache.post_cache.add(id, cached_post, ttl=ttl)
+
+    etag, body = cached_post
+    if utils.etag_matches(if_none_match, etag):
+        return utils.not_modified(etag)
+    json_response = Response(
+        content=body, media_type="application/json", headers={"ETag": etag}
     )
-    print(my_query)
-    query_result = my_query.first()
+    return json_response
 
-    if not query_result:
+
+def post_missing_or_forbidden(id: int, db: Session) -> None:
+    """This is used when an owner-checked update/delete of a post affected no
+    rows. It tells a missing post apart from a post made by another user.
+
+    Args:
+    -----
+    id: The id of the post to be updated/deleted.
+
+    Returns:
+    --------
+    It raises an HTTPException
+    """
+    if not db.query(models.Posts.id).filter(models.Posts.id == id).first():
         utils.error_msg(id)
 
-    return query_result
+    # the post wasn't made by the user
+    utils.error_msg_2()
 
 
 @router.put("/{id}", response_model=schemas.PostResponse)
@@ -122,18 +409,32 @@ def update_post(
     --------
     updated_post: The updated post.
     """
-    my_query = db.query(models.Posts).filter(models.Posts.id == id)  # query object
-    query_result = my_query.first()
+    # UPDATE ... WHERE id = :id AND owner_id = :user RETURNING *, with the owner
+    updated = (
+        update(models.Posts)
+        .where(models.Posts.id == id, models.Posts.owner_id == current_user)
+        .values(**post.dict(), version=models.Posts.version + 1)
+        .returning(
+            *models.Posts.__table__.columns,
+            *invalidation.returning("post", models.Posts.id),
+        )
+        .cte("updated")
+    )
+    updated_posts = aliased(models.Posts, updated)
+    query_result = db.execute(
+        select(updated_posts, models.Users).join(
+            models.Users, models.Users.id == updated_posts.owner_id
+        )
+    ).first()
 
     if not query_result:
-        utils.error_msg(id)
-
-    # check if the post was made by the user
-    if query_result.owner_id != current_user:
-        utils.error_msg_2()
-    my_query.update(post.dict(), synchronize_session=False)  # update the query object
+        post_missing_or_forbidden(id, db)
+    updated_post = query_result[0]
+    updated_post.owner  # it's taken from the identity map (no query is run)
+    db.expunge_all()  # the commit mustn't expire (and later reload) the result
     db.commit()
-    updated_post = my_query.first()
+    cache.evict_post(id)
+    search_index.backend.index_post(updated_post)
     return updated_post
 
 
@@ -156,15 +457,197 @@ def delete_post(
     --------
     None
     """
-    my_query = db.query(models.Posts).filter(models.Posts.id == id)  # query object
-    query_result = my_query.first()
+    # DELETE ... WHERE id = :id AND owner_id = :user RETURNING id
+    statement = (
+        delete(models.Posts)
+        .where(models.Posts.id == id, models.Posts.owner_id == current_user)
+        .returning(models.Posts.id, *invalidation.returning("post", models.Posts.id))
+        .execution_options(synchronize_session=False)
+    )
+    query_result = db.execute(statement).first()
 
     if not query_result:
-        utils.error_msg(id)
-
-    # check if the post was made by the user
-    if query_result.owner_id != current_user:
-        utils.error_msg_2()
-    my_query.delete(synchronize_session=False)  # delete the query object
+        post_missing_or_forbidden(id, db)
     db.commit()
+    cache.evict_post(id)
+    search_index.backend.remove_post(id)
+    ranking.remove_post(id)
+    broadcast.publish_deleted(id)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@async_router.post(
+    "/", status_code=status.HTTP_201_CREATED, response_model=schemas.PostResponse
+)
+async def create_post_async(
+    post: schemas.PostCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: int = Depends(oauth2.get_current_user_async),
+) -> Dict:
+    """This is the async version of `create_post`."""
+    return await utils.run_sync_route(
+        db, create_post, schemas.PostResponse, post=post, current_user=current_user
+    )
+
+
+@async_router.post(
+    "/bulk",
+    status_code=status.HTTP_201_CREATED,
+    response_model=schemas.BulkPostResponse,
+)
+async def bulk_create_posts_async(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: int = Depends(oauth2.get_current_user_async),
+) -> Dict:
+    """This is the async version of `bulk_create_posts`."""
+
+    async def insert_chunk(posts: List[schemas.PostCreate]) -> List[int]:
+        post_ids = await db.run_sync(ingest.insert_posts, posts, current_user)
+        index_bulk_posts(post_ids, posts)
+        return post_ids
+
+    media_type = request.headers.get("content-type", "").split(";")[0].strip()
+    return await ingest.bulk_insert(request.stream(), media_type, insert_chunk)
+
+
+@async_router.get("/", response_model=List[schemas.PostResponse2])
+async def get_posts_async(
+    response: Response,
+    db: AsyncSession = Depends(oauth2.get_read_db_async),
+    _: int = Depends(oauth2.get_current_user_async),
+    limit: int = 10,
+    skip: int = 0,
+    search: Optional[str] = "",
+    rank: bool = False,
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+) -> List[Dict]:
+    """This is the async version of `get_posts`."""
+    return await utils.run_sync_route(
+        db,
+        get_posts,
+        List[schemas.PostResponse2],
+        response=response,
+        _=_,
+        limit=limit,
+        skip=skip,
+        search=search,
+        rank=rank,
+        cursor=cursor,
+        if_none_match=if_none_match,
+    )
+
+
+@async_router.get("/export", response_model=List[schemas.PostResponse2])
+async def export_posts_async(
+    db: AsyncSession = Depends(oauth2.get_read_db_async),
+    _: int = Depends(oauth2.get_current_user_async),
+    export_format: schemas.ExportFormat = Query(
+        schemas.ExportFormat.ndjson, alias="format"
+    ),
+):
+    """This is the async version of `export_posts`."""
+    my_query = (
+        select(models.Posts, votebuffer.votes_column())
+        .options(joinedload(models.Posts.owner))
+        .order_by(models.Posts.id)
+        .execution_options(yield_per=serializers.EXPORT_CHUNK_SIZE)
+    )
+    my_query_result = await db.stream(my_query)
+    return serializers.export_response(
+        serializers.project_post_with_votes, my_query_result, export_format
+    )
+
+
+@async_router.get("/top", response_model=List[schemas.PostResponse2])
+async def get_top_posts_async(
+    response: Response,
+    db: AsyncSession = Depends(oauth2.get_read_db_async),
+    _: int = Depends(oauth2.get_current_user_async),
+    limit: int = 10,
+    skip: int = 0,
+    if_none_match: Optional[str] = Header(None),
+) -> List[Dict]:
+    """This is the async version of `get_top_posts`."""
+    return await utils.run_sync_route(
+        db,
+        get_top_posts,
+        List[schemas.PostResponse2],
+        response=response,
+        _=_,
+        limit=limit,
+        skip=skip,
+        if_none_match=if_none_match,
+    )
+
+
+@async_router.get("/trending", response_model=List[schemas.PostResponse2])
+async def get_trending_posts_async(
+    response: Response,
+    db: AsyncSession = Depends(oauth2.get_read_db_async),
+    _: int = Depends(oauth2.get_current_user_async),
+    limit: int = 10,
+    skip: int = 0,
+    if_none_match: Optional[str] = Header(None),
+) -> List[Dict]:
+    """This is the async version of `get_trending_posts`."""
+    return await utils.run_sync_route(
+        db,
+        get_trending_posts,
+        List[schemas.PostResponse2],
+        response=response,
+        _=_,
+        limit=limit,
+        skip=skip,
+        if_none_match=if_none_match,
+    )
+
+
+@async_router.get("/{id}", response_model=schemas.PostResponse2)
+async def get_post_async(
+    id: int,
+    db: AsyncSession = Depends(oauth2.get_read_db_async),
+    _: int = Depends(oauth2.get_current_user_async),
+    if_none_match: Optional[str] = Header(None),
+) -> Dict:
+    """This is the async version of `get_post`."""
+    return await utils.run_sync_route(
+        db,
+        get_post,
+        schemas.PostResponse2,
+        id=id,
+        _=_,
+        if_none_match=if_none_match,
+    )
+
+
+@async_router.put("/{id}", response_model=schemas.PostResponse)
+async def update_post_async(
+    id: int,
+    post: schemas.PostUpdate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: int = Depends(oauth2.get_current_user_async),
+) -> Dict:
+    """This is the async version of `update_post`."""
+    return await utils.run_sync_route(
+        db,
+        update_post,
+        schemas.PostResponse,
+        id=id,
+        post=post,
+        current_user=current_user,
+    )
+
+
+@async_router.delete(
+    "/{id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+)
+async def delete_post_async(
+    id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: int = Depends(oauth2.get_current_user_async),
+) -> None:
+    """This is the async version of `delete_post`."""
+    return await utils.run_sync_route(db, delete_post, id=id, current_user=current_user)
@@ -1,19 +1,17 @@
-from typing import List, Dict
-from fastapi import HTTPException, Response, status, Depends, APIRouter
+from typing import List, Dict, Optional
+from fastapi import Header, HTTPException, Query, Response, status, Depends
+from fastapi import APIRouter
+from sqlalchemy import exc, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-import os
-import sys
 
-curr_dir = os.path.dirname(__file__)
-top_dir = os.path.abspath(os.path.join(curr_dir, ".."))
-
-# insert top_dir into system path
-sys.path.insert(0, top_dir)
-
-from database import get_db
-import models, schemas, utils, oauth2
+from config import settings
+from database import get_db, get_async_db
+import models, schemas, serializers, utils, oauth2
 
 router = APIRouter(prefix="/users", tags=["Users"])
+# used instead of `router` when settings.DATABASE_ASYNC is enabled
+async_router = APIRouter(prefix="/users", tags=["Users"])
 
 
 @router.post(
@@ -30,11 +28,9 @@ def create_user(body: schemas.UserCreate, db: Session = Depends(get_db)) -> Dict
     --------
     new_user_info: The newly created user info.
     """
-    from sqlalchemy import exc
-
     try:
         # hash the user password
-        hashed_pswd = utils.hash_password(body.password)
+        hashed_pswd = utils.run_hashing(utils.hash_password, body.password)
         # update the password
         body.password = hashed_pswd
         new_user_info = models.Users(**body.dict())
@@ -51,15 +47,19 @@ def create_user(body: schemas.UserCreate, db: Session = Depends(get_db)) -> Dict
 
 @router.get("/{id}", response_model=schemas.UserResponse)
 def get_user_by_id(
+    response: Response,
     id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(oauth2.get_read_db),
     current_user: int = Depends(oauth2.get_current_user),
+    if_none_match: Optional[str] = Header(None),
 ) -> Dict:
     """This is used to get the basic information of a specific user using the user id.
 
     Args:
     -----
     id: The user id.
+    if_none_match: The ETag of a previous response. A 304 is returned when the
+    user didn't change.
 
     Returns:
     --------
@@ -71,21 +71,128 @@ def get_user_by_id(
     if not query_result:
         utils.error_msg(id)
 
+    # the returned fields (id, email, created_at) never change
+    etag = utils.make_etag("user", id, query_result.created_at)
+    if utils.etag_matches(if_none_match, etag):
+        return utils.not_modified(etag)
+    response.headers["ETag"] = etag
     return query_result
 
 
 @router.get("", response_model=List[schemas.UserResponse])
 def get_all_users(
-    db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)
+    response: Response,
+    db: Session = Depends(oauth2.get_read_db),
+    current_user: int = Depends(oauth2.get_current_user),
+    export_format: Optional[schemas.ExportFormat] = Query(None, alias="format"),
 ):
     """This is used to get the basic information of all users.
 
     Args:
     -----
+    export_format: When it's given ("ndjson" or "json"), the users are streamed
+    from a server-side cursor, so the memory use doesn't grow with the table.
 
     Returns:
     --------
     all_users_info: The newly created user info.
     """
+    if export_format:
+        my_query = (
+            db.query(models.Users)
+            .order_by(models.Users.id)
+            .yield_per(serializers.EXPORT_CHUNK_SIZE)
+        )
+        return serializers.export_response(
+            serializers.project_user, my_query, export_format
+        )
+
     my_query_result = db.query(models.Users).all()
+    if settings.FAST_JSON:
+        return serializers.fast_json_response(
+            serializers.project_user, my_query_result, response
+        )
     return my_query_result
+
+
+@async_router.post(
+    "/", status_code=status.HTTP_201_CREATED, response_model=schemas.UserResponse
+)
+async def create_user_async(
+    body: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)
+) -> Dict:
+    """This is the async version of `create_user`.
+
+    Args:
+    -----
+    body: The user details.
+
+    Returns:
+    --------
+    new_user_info: The newly created user info.
+    """
+    try:
+        # hash the user password
+        hashed_pswd = await utils.run_hashing_async(utils.hash_password, body.password)
+        # update the password
+        body.password = hashed_pswd
+        new_user_info = models.Users(**body.dict())
+        db.add(new_user_info)
+        await db.commit()
+        await db.refresh(new_user_info)  # load the server defaults (created_at)
+        return new_user_info
+
+    except exc.IntegrityError:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail=f"The email: {body.email} is already taken. Try another email.",
+        )
+
+
+@async_router.get("/{id}", response_model=schemas.UserResponse)
+async def get_user_by_id_async(
+    response: Response,
+    id: int,
+    db: AsyncSession = Depends(oauth2.get_read_db_async),
+    current_user: int = Depends(oauth2.get_current_user_async),
+    if_none_match: Optional[str] = Header(None),
+) -> Dict:
+    """This is the async version of `get_user_by_id`."""
+    return await utils.run_sync_route(
+        db,
+        get_user_by_id,
+        schemas.UserResponse,
+        response=response,
+        id=id,
+        current_user=current_user,
+        if_none_match=if_none_match,
+    )
+
+
+@async_router.get("", response_model=List[schemas.UserResponse])
+async def get_all_users_async(
+    response: Response,
+    db: AsyncSession = Depends(oauth2.get_read_db_async),
+    current_user: int = Depends(oauth2.get_current_user_async),
+    export_format: Optional[schemas.ExportFormat] = Query(None, alias="format"),
+):
+    """This is the async version of `get_all_users`."""
+    if export_format:
+        my_query = (
+            select(models.Users)
+            .order_by(models.Users.id)
+            .execution_options(yield_per=serializers.EXPORT_CHUNK_SIZE)
+        )
+        my_query_result = await db.stream(my_query)
+        return serializers.export_response(
+            serializers.project_user, my_query_result.scalars(), export_format
+        )
+
+    return await utils.run_sync_route(
+        db,
+        get_all_users,
+        List[schemas.UserResponse],
+        response=response,
+        current_user=current_user,
+        export_format=None,
+    )
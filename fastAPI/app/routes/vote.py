@@ -1,19 +1,19 @@
-from typing import Dict
+from typing import Dict, List, Set, Tuple
 from fastapi import Depends, APIRouter, status, HTTPException
 
+from sqlalchemy import Integer, column, delete, exc, update, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-import os
-import sys
-
-curr_dir = os.path.dirname(__name__)
-top_dir = os.path.abspath(os.path.join(curr_dir, "../"))
-sys.path.insert(0, top_dir)
-
-import models, oauth2, schemas
-from database import get_db
 
+import broadcast, cache, invalidation, models, oauth2, ranking, schemas, utils
+import votebuffer
+from config import settings
+from database import get_db, get_async_db
 
 router = APIRouter(prefix="/votes", tags=["Vote"])
+# used instead of `router` when settings.DATABASE_ASYNC is enabled
+async_router = APIRouter(prefix="/votes", tags=["Vote"])
 
 
 @router.post("", status_code=status.HTTP_201_CREATED)
@@ -32,40 +32,306 @@ def vote(
     --------
     response: A reponse indicating a vote was successfully added or deleted.
     """
-    # verify that post_id exists
-    post = db.query(models.Posts).filter(models.Posts.id == body.post_id).first()
+    if settings.VOTE_BUFFER:
+        return buffer_vote(body, db, current_user)
+
+    # add vote (and bump the post's vote counter) in a single statement
+    if body.dir == 1:
+        new_vote = (
+            insert(models.Votes)
+            .values(post_id=body.post_id, user_id=current_user)
+            .on_conflict_do_nothing()
+            .returning(models.Votes.post_id)
+            .cte("new_vote")
+        )
+        statement = (
+            update(models.Posts)
+            .where(models.Posts.id == new_vote.c.post_id)
+            .values(vote_count=models.Posts.vote_count + 1)
+            .returning(
+                models.Posts.id,
+                models.Posts.vote_count,
+                models.Posts.created_at,
+                *invalidation.returning("post", models.Posts.id),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        try:
+            query_result = db.execute(statement).first()
+        except exc.IntegrityError:  # foreign key violation
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Post:{body.post_id} doesn't exist.",
+            )
+        db.commit()
+
+        if not query_result:  # if the user has already voted (liked) the post
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"User:{current_user} has already voted.",
+            )
+        cache.evict_post(body.post_id)  # its vote count changed
+        ranking.update_post(
+            body.post_id, query_result.vote_count, query_result.created_at
+        )
+        broadcast.publish_votes(body.post_id, query_result.vote_count, 1)
+        return {"Vote successful"}
+
+    # delete vote (and decrement the post's vote counter) in a single statement
+    old_vote = (
+        delete(models.Votes)
+        .where(
+            models.Votes.post_id == body.post_id, models.Votes.user_id == current_user
+        )
+        .returning(models.Votes.post_id)
+        .cte("old_vote")
+    )
+    statement = (
+        update(models.Posts)
+        .where(models.Posts.id == old_vote.c.post_id)
+        .values(vote_count=models.Posts.vote_count - 1)
+        .returning(
+            models.Posts.id,
+            models.Posts.vote_count,
+            models.Posts.created_at,
+            *invalidation.returning("post", models.Posts.id),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    query_result = db.execute(statement).first()
+    db.commit()
+
+    if query_result:  # if the vote existed in the DB
+        cache.evict_post(body.post_id)  # its vote count changed
+        ranking.update_post(
+            body.post_id, query_result.vote_count, query_result.created_at
+        )
+        broadcast.publish_votes(body.post_id, query_result.vote_count, -1)
+        return {"Vote successfully deleted!"}
+
+    # nothing was deleted. Tell a missing post apart from a missing vote.
+    post = db.query(models.Posts.id).filter(models.Posts.id == body.post_id).first()
     if not post:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail=f"Post:{body.post_id} doesn't exist.",
         )
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"Vote does not exist!",
+    )
+
 
-    query = db.query(models.Votes).filter(
-        models.Votes.post_id == body.post_id, models.Votes.user_id == current_user
+def buffer_vote(body: schemas.VoteCreate, db: Session, current_user: int) -> Dict:
+    """This is the write-behind version of `vote` (settings.VOTE_BUFFER). The
+    vote is checked against the votes table and the buffer, then recorded in the
+    buffer, without locking the post.
+
+    Args:
+    -----
+    body: The content of the vote. i.e the user input.
+    db: The database session.
+    current_user: The ID of the logged in user.
+
+    Returns:
+    --------
+    response: A reponse indicating a vote was successfully added or deleted.
+    """
+    # the post and the persisted vote of the user on it, if any
+    query_result = (
+        db.query(models.Posts.id, models.Votes.user_id)
+        .outerjoin(
+            models.Votes,
+            (models.Votes.post_id == models.Posts.id)
+            & (models.Votes.user_id == current_user),
+        )
+        .filter(models.Posts.id == body.post_id)
+        .first()
     )
-    query_result = query.first()
+    if not query_result:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Post:{body.post_id} doesn't exist.",
+        )
 
-    # add vote
-    if body.dir == 1:
-        if query_result:  # if the user has already voted (liked) the post
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail=f"User:{current_user} has already voted.",
-            )
-        else:
-            add_vote = models.Votes(post_id=body.post_id, user_id=current_user)
-            db.add(add_vote)
-            db.commit()
-            return {"Vote successful"}
-
-    # delete vote
-    if body.dir < 1:
-        if query_result:  # if vote exists in the DB
-            query.delete(synchronize_session=False)
-            db.commit()
-            return {"Vote successfully deleted!"}
+    has_voted = query_result.user_id is not None
+    outcome = votebuffer.buffer.record(body.post_id, current_user, body.dir, has_voted)
+    if outcome == "already_voted":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"User:{current_user} has already voted.",
+        )
+    if outcome == "vote_not_found":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Vote does not exist!",
+        )
+    if outcome == "added":
+        return {"Vote successful"}
+    return {"Vote successfully deleted!"}
+
+
+def replay_votes(
+    votes: List[schemas.VoteCreate], existing_posts: Set[int], initial_votes: Set[int]
+) -> Tuple[List[Dict], Set[int]]:
+    """This is used to replay a batch of votes of a user, in order, against the
+    current state, to get the outcome of each vote and the votes to persist.
+
+    Args:
+    -----
+    votes: The votes of the batch.
+    existing_posts: The ids of the voted posts which exist.
+    initial_votes: The ids of the posts the user has voted on.
+
+    Returns:
+    --------
+    outcomes: The outcome of each vote.
+    final_votes: The ids of the posts the user has voted on after the batch.
+    """
+    final_votes = set(initial_votes)
+    outcomes = []
+    for item in votes:
+        if item.post_id not in existing_posts:
+            outcome = "post_not_found"
+        elif item.dir == 1:
+            outcome = "already_voted" if item.post_id in final_votes else "added"
+            final_votes.add(item.post_id)
         else:
+            outcome = "removed" if item.post_id in final_votes else "vote_not_found"
+            final_votes.discard(item.post_id)
+        outcomes.append({"post_id": item.post_id, "dir": item.dir, "outcome": outcome})
+    return outcomes, final_votes
+
+
+@router.post(
+    "/batch", status_code=status.HTTP_200_OK, response_model=List[schemas.VoteOutcome]
+)
+def vote_batch(
+    body: schemas.VoteBatch,
+    db: Session = Depends(get_db),
+    current_user: int = Depends(oauth2.get_current_user),
+) -> List[Dict]:
+    """This is used to apply many votes at once (e.g. likes made offline). The
+    votes are applied in order, in a single transaction, with a fixed number of
+    statements whatever the size of the batch.
+
+    Args:
+    -----
+    body: The list of votes.
+
+    Returns:
+    --------
+    outcomes: The outcome of each vote.
+    """
+    post_ids = {item.post_id for item in body}
+    existing_posts = {
+        row.id
+        for row in db.query(models.Posts.id).filter(models.Posts.id.in_(post_ids))
+    }
+    initial_votes = {
+        row.post_id
+        for row in db.query(models.Votes.post_id).filter(
+            models.Votes.user_id == current_user, models.Votes.post_id.in_(post_ids)
+        )
+    }
+
+    if settings.VOTE_BUFFER:
+        # the buffer replays the votes against the votes table and itself
+        outcomes = []
+        for item in body:
+            outcome = "post_not_found"
+            if item.post_id in existing_posts:
+                has_voted = item.post_id in initial_votes
+                outcome = votebuffer.buffer.record(
+                    item.post_id, current_user, item.dir, has_voted
+                )
+            outcomes.append(
+                {"post_id": item.post_id, "dir": item.dir, "outcome": outcome}
+            )
+        return outcomes
+
+    outcomes, final_votes = replay_votes(body, existing_posts, initial_votes)
+
+    # apply the net changes with set-based statements
+    deltas = {}
+    added = final_votes - initial_votes
+    if added:
+        statement = (
+            insert(models.Votes)
+            .values([{"post_id": id, "user_id": current_user} for id in added])
+            .on_conflict_do_nothing()
+            .returning(models.Votes.post_id)
+        )
+        try:
+            for row in db.execute(statement):
+                deltas[row.post_id] = 1
+        except exc.IntegrityError:  # a post was deleted in the meantime
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
-                detail=f"Vote does not exist!",
+                detail="Some posts don't exist anymore. Try again.",
+            )
+    removed = initial_votes - final_votes
+    if removed:
+        statement = (
+            delete(models.Votes)
+            .where(
+                models.Votes.user_id == current_user, models.Votes.post_id.in_(removed)
             )
+            .returning(models.Votes.post_id)
+        )
+        for row in db.execute(statement):
+            deltas[row.post_id] = -1
+
+    # UPDATE posts SET vote_count = vote_count + delta FROM (VALUES ...)
+    voted_posts = []
+    if deltas:
+        vote_deltas = values(
+            column("post_id", Integer), column("delta", Integer), name="vote_deltas"
+        ).data(list(deltas.items()))
+        voted_posts = db.execute(
+            update(models.Posts)
+            .where(models.Posts.id == vote_deltas.c.post_id)
+            .values(vote_count=models.Posts.vote_count + vote_deltas.c.delta)
+            .returning(
+                models.Posts.id,
+                models.Posts.vote_count,
+                models.Posts.created_at,
+                *invalidation.returning("post", models.Posts.id),
+            )
+            .execution_options(synchronize_session=False)
+        ).all()
+    db.commit()
+    for row in voted_posts:  # their vote count changed
+        cache.evict_post(row.id)
+        ranking.update_post(row.id, row.vote_count, row.created_at)
+        broadcast.publish_votes(row.id, row.vote_count, deltas[row.id])
+
+    return outcomes
+
+
+@async_router.post("", status_code=status.HTTP_201_CREATED)
+async def vote_async(
+    body: schemas.VoteCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: int = Depends(oauth2.get_current_user_async),
+) -> Dict:
+    """This is the async version of `vote`."""
+    return await utils.run_sync_route(db, vote, body=body, current_user=current_user)
+
+
+@async_router.post(
+    "/batch", status_code=status.HTTP_200_OK, response_model=List[schemas.VoteOutcome]
+)
+async def vote_batch_async(
+    body: schemas.VoteBatch,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: int = Depends(oauth2.get_current_user_async),
+) -> List[Dict]:
+    """This is the async version of `vote_batch`."""
+    return await utils.run_sync_route(
+        db,
+        vote_batch,
+        List[schemas.VoteOutcome],
+        body=body,
+        current_user=current_user,
+    )
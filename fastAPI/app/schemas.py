@@ -1,8 +1,9 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, EmailStr
 from datetime import datetime
+from enum import Enum
 
-from pydantic.types import conint
+from pydantic.types import conint, conlist
 
 
 class UserBase(BaseModel):
@@ -70,6 +71,20 @@ class PostResponse(PostBase):
         orm_mode = True
 
 
+class BulkPostError(BaseModel):
+    """This is used to report an invalid line of a bulk upload of posts."""
+
+    line: int
+    error: str
+
+
+class BulkPostResponse(BaseModel):
+    """This is used to validate the result of a bulk upload of posts."""
+
+    inserted_ids: List[int]
+    errors: List[BulkPostError]
+
+
 class PostResponse2(BaseModel):
     """It validates the posts and the number of votes each post has."""
 
@@ -105,3 +120,24 @@ class VoteCreate(BaseModel):
 
     post_id: int
     dir: conint(le=1)  # direction
+
+
+class VoteOutcome(BaseModel):
+    """This is used to report what happened to each vote of a batch."""
+
+    post_id: int
+    dir: int
+    # "added", "removed", "already_voted", "vote_not_found" or "post_not_found"
+    outcome: str
+
+
+# the votes of a batch are applied in order. e.g. a like followed by an unlike
+# of the same post leaves the post without a vote.
+VoteBatch = conlist(VoteCreate, min_items=1, max_items=500)
+
+
+class ExportFormat(str, Enum):
+    """This is used to choose how the rows of an export are streamed."""
+
+    ndjson = "ndjson"  # one JSON object per line
+    json = "json"  # a single JSON array
@@ -0,0 +1,145 @@
+from typing import Dict, List, Set
+from collections import Counter, defaultdict
+import re
+import threading
+from sqlalchemy import case, func, literal_column
+from sqlalchemy.orm import Query, Session
+from config import settings
+import models
+
+
+# the text search configuration used by the Postgres backend. It must match the
+# one used by the GIN index created in models.py.
+TS_CONFIG = literal_column("'english'::regconfig")
+SEPARATOR = literal_column("' '")
+
+
+class SearchBackend:
+    """This is the interface every search backend must implement."""
+
+    def index_post(self, post: models.Posts) -> None:
+        """This is used to add/refresh a post in the search index."""
+        raise NotImplementedError
+
+    def remove_post(self, post_id: int) -> None:
+        """This is used to remove a post from the search index."""
+        raise NotImplementedError
+
+    def rebuild(self, db: Session) -> None:
+        """This is used to (re)build the search index from the posts table."""
+        raise NotImplementedError
+
+    def filter(self, query: Query, term: str) -> Query:
+        """This is used to restrict a posts query to the posts matching `term`."""
+        raise NotImplementedError
+
+    def rank(self, term: str):
+        """This returns an SQL expression which scores how well a post matches
+        `term`. A higher score means a better match."""
+        raise NotImplementedError
+
+
+class PostgresSearchBackend(SearchBackend):
+    """This uses Postgres full-text search over the title and content of the
+    posts. The GIN index is maintained by Postgres itself, so there is nothing
+    to do on writes."""
+
+    def __init__(self) -> None:
+        # the separator is inlined (not a bound parameter) so the expression is
+        # the one of the GIN index with every driver (asyncpg keeps parameters)
+        self.document = func.to_tsvector(
+            TS_CONFIG, models.Posts.title + SEPARATOR + models.Posts.content
+        )
+
+    def index_post(self, post: models.Posts) -> None:
+        pass
+
+    def remove_post(self, post_id: int) -> None:
+        pass
+
+    def rebuild(self, db: Session) -> None:
+        pass
+
+    def filter(self, query: Query, term: str) -> Query:
+        return query.filter(
+            self.document.op("@@")(func.plainto_tsquery(TS_CONFIG, term))
+        )
+
+    def rank(self, term: str):
+        return func.ts_rank(self.document, func.plainto_tsquery(TS_CONFIG, term))
+
+
+class InMemorySearchBackend(SearchBackend):
+    """This keeps an in-process inverted index (token -> post ids). It is meant
+    for SQLite/tests, where Postgres full-text search isn't available."""
+
+    token_pattern = re.compile(r"\w+")
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+        self._documents: Dict[int, Counter] = {}
+
+    def tokenize(self, text: str) -> List[str]:
+        """This is used to split a text into lowercase tokens."""
+        return self.token_pattern.findall(text.lower())
+
+    def index_post(self, post: models.Posts) -> None:
+        tokens = Counter(self.tokenize(f"{post.title} {post.content}"))
+        with self._lock:
+            self._remove(post.id)
+            self._documents[post.id] = tokens
+            for token in tokens:
+                self._postings[token].add(post.id)
+
+    def remove_post(self, post_id: int) -> None:
+        with self._lock:
+            self._remove(post_id)
+
+    def _remove(self, post_id: int) -> None:
+        """This removes a post from the index. The lock must be held."""
+        tokens = self._documents.pop(post_id, None) or {}
+        for token in tokens:
+            self._postings[token].discard(post_id)
+            if not self._postings[token]:
+                del self._postings[token]
+
+    def rebuild(self, db: Session) -> None:
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+        for post in db.query(models.Posts).yield_per(1000):
+            self.index_post(post)
+
+    def scores(self, term: str) -> Dict[int, int]:
+        """This returns the ids of the posts containing every token of `term`,
+        mapped to the number of occurrences of those tokens in each post."""
+        tokens = set(self.tokenize(term))
+        if not tokens:
+            return {}
+        with self._lock:
+            matches = set.intersection(
+                *(self._postings.get(token, set()) for token in tokens)
+            )
+            return {
+                post_id: sum(self._documents[post_id][token] for token in tokens)
+                for post_id in matches
+            }
+
+    def filter(self, query: Query, term: str) -> Query:
+        return query.filter(models.Posts.id.in_(list(self.scores(term))))
+
+    def rank(self, term: str):
+        post_scores = self.scores(term)
+        if not post_scores:
+            return literal_column("0")
+        return case(post_scores, value=models.Posts.id, else_=0)
+
+
+search_backends = {
+    "postgres": PostgresSearchBackend,
+    "memory": InMemorySearchBackend,
+}
+
+# the search backend used by the posts routes.
+backend: SearchBackend = search_backends[settings.SEARCH_BACKEND]()
@@ -0,0 +1,181 @@
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable
+from typing import Iterator, List, Type
+from operator import attrgetter
+import orjson
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON
+import schemas
+
+
+def compile_projection(model: Type[BaseModel]) -> Callable[[Any], Dict]:
+    """This is used to build a function which turns an ORM object/row straight
+    into a dict with the same keys (and key order) as the given response model,
+    without going through the Pydantic validation.
+
+    Args:
+    -----
+    model: The (orm_mode) response model.
+
+    Returns:
+    --------
+    project: The function converting an ORM object/row into a dict.
+    """
+    fields = []
+    for name, field in model.__fields__.items():
+        nested = None
+        model_field = isinstance(field.type_, type) and issubclass(
+            field.type_, BaseModel
+        )
+        if model_field and field.shape == SHAPE_SINGLETON:
+            nested = compile_projection(field.type_)
+        fields.append((name, attrgetter(name), nested))
+    fields = tuple(fields)
+
+    def project(obj: Any) -> Dict:
+        data = {}
+        for name, get, nested in fields:
+            value = get(obj)
+            data[name] = nested(value) if nested and value is not None else value
+        return data
+
+    return project
+
+
+# the projections are built once, at import time.
+project_post_with_votes = compile_projection(schemas.PostResponse2)
+project_user = compile_projection(schemas.UserResponse)
+
+
+def fast_json_response(
+    project: Callable[[Any], Dict], rows: Iterable, response: Response
+) -> Response:
+    """This is used to serialize the rows of a list endpoint with orjson. The
+    JSON is the same as the one produced through the response model.
+
+    Args:
+    -----
+    project: The projection of the response model of the rows.
+    rows: The query results.
+    response: The response injected in the route. Its headers are kept.
+
+    Returns:
+    --------
+    json_response: The serialized rows.
+    """
+    body = orjson.dumps([project(row) for row in rows])
+    json_response = Response(
+        content=body, media_type="application/json", headers=dict(response.headers)
+    )
+    return json_response
+
+
+# the number of rows fetched from the server-side cursor and sent per chunk
+EXPORT_CHUNK_SIZE = 1000
+
+export_media_types = {
+    schemas.ExportFormat.ndjson: "application/x-ndjson",
+    schemas.ExportFormat.json: "application/json",
+}
+
+
+def encode_chunk(
+    project: Callable[[Any], Dict],
+    rows: List,
+    export_format: schemas.ExportFormat,
+    first: bool,
+) -> bytes:
+    """This is used to serialize a chunk of rows of an export.
+
+    Args:
+    -----
+    project: The projection of the response model of the rows.
+    rows: The rows of the chunk.
+    export_format: NDJSON (one object per line) or a JSON array.
+    first: Whether it's the first chunk of the export.
+
+    Returns:
+    --------
+    chunk: The serialized rows.
+    """
+    if export_format == schemas.ExportFormat.ndjson:
+        return b"".join(orjson.dumps(project(row)) + b"\n" for row in rows)
+    chunk = b",".join(orjson.dumps(project(row)) for row in rows)
+    return chunk if first else b"," + chunk
+
+
+def iter_export(
+    project: Callable[[Any], Dict],
+    rows: Iterable,
+    export_format: schemas.ExportFormat,
+) -> Iterator[bytes]:
+    """This is used to serialize the rows of an export incrementally, one chunk
+    at a time, so the memory use doesn't depend on the number of rows.
+
+    Args:
+    -----
+    project: The projection of the response model of the rows.
+    rows: The rows (e.g. a query using a server-side cursor).
+    export_format: NDJSON (one object per line) or a JSON array.
+
+    Returns:
+    --------
+    chunks: The serialized chunks.
+    """
+    if export_format == schemas.ExportFormat.json:
+        yield b"["
+    chunk, first = [], True
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == EXPORT_CHUNK_SIZE:
+            yield encode_chunk(project, chunk, export_format, first)
+            chunk, first = [], False
+    if chunk:
+        yield encode_chunk(project, chunk, export_format, first)
+    if export_format == schemas.ExportFormat.json:
+        yield b"]"
+
+
+async def aiter_export(
+    project: Callable[[Any], Dict],
+    rows: AsyncIterable,
+    export_format: schemas.ExportFormat,
+) -> AsyncIterator[bytes]:
+    """This is the async version of `iter_export`."""
+    if export_format == schemas.ExportFormat.json:
+        yield b"["
+    chunk, first = [], True
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) == EXPORT_CHUNK_SIZE:
+            yield encode_chunk(project, chunk, export_format, first)
+            chunk, first = [], False
+    if chunk:
+        yield encode_chunk(project, chunk, export_format, first)
+    if export_format == schemas.ExportFormat.json:
+        yield b"]"
+
+
+def export_response(
+    project: Callable[[Any], Dict],
+    rows: Iterable,
+    export_format: schemas.ExportFormat,
+) -> StreamingResponse:
+    """This is used to stream the rows of an export (sync or async iterable).
+
+    Args:
+    -----
+    project: The projection of the response model of the rows.
+    rows: The rows (e.g. a query using a server-side cursor).
+    export_format: NDJSON (one object per line) or a JSON array.
+
+    Returns:
+    --------
+    streaming_response: The streamed rows.
+    """
+    if hasattr(rows, "__aiter__"):
+        chunks = aiter_export(project, rows, export_format)
+    else:
+        chunks = iter_export(project, rows, export_format)
+    return StreamingResponse(chunks, media_type=export_media_types[export_format])
@@ -1,10 +1,33 @@
-from typing import Optional, List, Dict
-from fastapi import HTTPException, status
+from typing import Any, Callable, Optional, List, Dict, Tuple
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import base64
+import binascii
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from fastapi import HTTPException, Response, status
 from passlib.context import CryptContext
+from pydantic import parse_obj_as
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import settings
 
 
-# for password hashing
-pswd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# for password hashing. Hashes made with another cost factor need an update.
+pswd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+)
+
+# the pool which runs the (CPU bound) password hashing off the request threads.
+# It's created at startup (see `main.start_hashing_executor`).
+hashing_executor: Optional[Executor] = None
+hashing_executor_lock = threading.Lock()
 
 
 def error_msg(id: int) -> Dict:
@@ -71,3 +94,203 @@ def verify_password(login_attempt: str, actual_pswd: str):
     global pswd_context
     v_resp = pswd_context.verify(login_attempt, actual_pswd)
     return v_resp
+
+
+def verify_and_update_password(
+    login_attempt: str, actual_pswd: str
+) -> Tuple[bool, Optional[str]]:
+    """This is used to verify the user's password and rehash it when it was
+    hashed with an outdated cost factor.
+
+    Args:
+    -----
+    login_attempt: The attempted password.
+    actual_pswd: The actual (hashed) password
+
+    Returns:
+    --------
+    v_resp: The verification response.
+    new_hash: The upgraded hash or None if the hash is up to date.
+    """
+    global pswd_context
+    v_resp, new_hash = pswd_context.verify_and_update(login_attempt, actual_pswd)
+    return v_resp, new_hash
+
+
+def get_hashing_executor() -> Executor:
+    """This returns the pool used for password hashing (and creates it on the
+    first call). It's a process pool by default, so bcrypt doesn't compete with
+    the request threads for the GIL.
+
+    Returns:
+    --------
+    hashing_executor: The password hashing pool.
+    """
+    global hashing_executor
+    with hashing_executor_lock:
+        if hashing_executor is None:
+            max_workers = settings.PASSWORD_HASHING_WORKERS or os.cpu_count()
+            if settings.PASSWORD_HASHING_EXECUTOR == "thread":
+                hashing_executor = ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix="password-hashing"
+                )
+            else:
+                # its processes aren't forked from this (multi-threaded) one,
+                # whose locks may be held by another thread at fork time
+                hashing_executor = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                )
+    return hashing_executor
+
+
+def shutdown_hashing_executor() -> None:
+    """This is used to stop the password hashing pool (if it was created)."""
+    global hashing_executor
+    with hashing_executor_lock:
+        if hashing_executor is not None:
+            hashing_executor.shutdown()
+            hashing_executor = None
+
+
+def run_hashing(func: Callable, *args) -> Any:
+    """This is used to run a password hashing function (e.g. `hash_password`) on
+    the hashing pool and wait for its result. It blocks the calling thread: the
+    async routes use `run_hashing_async` instead.
+
+    Args:
+    -----
+    func: The hashing function. It must be picklable (defined at module level).
+    args: The arguments of the hashing function.
+
+    Returns:
+    --------
+    result: The result of the hashing function.
+    """
+    return get_hashing_executor().submit(func, *args).result()
+
+
+async def run_hashing_async(func: Callable, *args) -> Any:
+    """This is the async version of `run_hashing`."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hashing_executor(), func, *args)
+
+
+def encode_cursor(last_id: int) -> str:
+    """This is used to create an opaque pagination cursor.
+
+    Args:
+    -----
+    last_id: The id of the last post on the current page.
+
+    Returns:
+    --------
+    cursor: The url-safe cursor pointing to the next page.
+    """
+    payload = json.dumps({"id": last_id}, separators=(",", ":")).encode()
+    cursor = base64.urlsafe_b64encode(payload).decode().rstrip("=")
+    return cursor
+
+
+def decode_cursor(cursor: str) -> int:
+    """This is used to extract the last seen post id from a pagination cursor.
+
+    Args:
+    -----
+    cursor: The cursor obtained from a previous page.
+
+    Returns:
+    --------
+    last_id: The id of the last post on the previous page.
+    """
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        last_id = int(payload["id"])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor.",
+        )
+    return last_id
+
+
+def make_etag(*versions: Any) -> str:
+    """This is used to create a strong ETag from the versions of the rows a
+    response is made of (not from the serialized response).
+
+    Args:
+    -----
+    versions: The values identifying the state of the rows (e.g. their id,
+    version and vote counter).
+
+    Returns:
+    --------
+    etag: The quoted ETag.
+    """
+    digest = hashlib.blake2b(repr(versions).encode(), digest_size=16).hexdigest()
+    etag = f'"{digest}"'
+    return etag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """This tells whether the `If-None-Match` header of a request matches the
+    current ETag (with the weak comparison used by If-None-Match)."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def not_modified(etag: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    """This returns the body-less 304 response of a conditional request.
+
+    Args:
+    -----
+    etag: The current ETag.
+    headers: The other headers of the response (e.g. X-Next-Cursor).
+
+    Returns:
+    --------
+    not_modified_response: The 304 response.
+    """
+    not_modified_response = Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={**(headers or {}), "ETag": etag},
+    )
+    return not_modified_response
+
+
+async def run_sync_route(
+    db: AsyncSession, route: Callable, response_model: Any = None, **kwargs
+) -> Any:
+    """This is used to run a sync route handler on the connection of an async
+    session, so the async routes can share the query logic of the sync ones.
+
+    The handler runs on the event loop thread (in a greenlet): only its queries
+    (and the Redis commands of `cache.RedisCache`) are awaited. It must not block
+    otherwise, e.g. wait on an event or a future (`run_hashing`), sleep or do
+    other network I/O, since that stalls every request of the worker. Such
+    steps belong in the async route (e.g. `run_hashing_async`).
+
+    Args:
+    -----
+    db: The async database session.
+    route: The sync route handler. It receives the sync session as `db`.
+    response_model: The response model of the route. The result is converted to
+    it inside the session, while lazy loading (e.g. `Posts.owner`) still works.
+    kwargs: The other arguments of the route handler.
+
+    Returns:
+    --------
+    result: The (converted) result of the route handler.
+    """
+
+    def call_route(session):
+        result = route(db=session, **kwargs)
+        if response_model is None or isinstance(result, Response):
+            return result
+        return parse_obj_as(response_model, result)
+
+    result = await db.run_sync(call_route)
+    return result
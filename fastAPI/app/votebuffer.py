@@ -0,0 +1,255 @@
+from typing import Dict, List, Optional, Tuple
+import logging
+import threading
+from sqlalchemy import Integer, cast, column, delete, func, tuple_, update, values
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import select
+from sqlalchemy.sql.elements import Grouping
+from config import settings
+import broadcast
+import cache
+import database
+import invalidation
+import models
+import ranking
+
+logger = logging.getLogger("app.votes")
+
+# (persisted state, wanted state) of the vote of a user on a post, by
+# (post id, user id). True means voted.
+VoteChanges = Dict[Tuple[int, int], Tuple[bool, bool]]
+
+
+class VoteBuffer:
+    """This is the write-behind buffer of the votes (settings.VOTE_BUFFER). The
+    votes are recorded in memory and flushed in a few set-based statements, so
+    the votes on a hot post don't queue on its row lock one by one.
+
+    The buffer keeps the last vote of each user on each post (a like and an
+    unlike cancel out) and the net change of the vote count of each post, which
+    the reads add to the persisted counts.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pending: VoteChanges = {}
+        self._in_flight: VoteChanges = {}  # being flushed
+        self._deltas: Dict[int, int] = {}  # of the pending and in-flight votes
+        self._wake_up = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, post_id: int, user_id: int, dir: int, persisted: bool) -> str:
+        """This is used to record a vote, with the same outcomes as the votes
+        written right away.
+
+        Args:
+        -----
+        post_id: The ID of the (existing) post.
+        user_id: The ID of the user.
+        dir: 1 to vote, 0 to remove the vote.
+        persisted: Whether the votes table has a vote of the user on the post.
+
+        Returns:
+        --------
+        outcome: "added", "removed", "already_voted" or "vote_not_found".
+        """
+        key = (post_id, user_id)
+        with self._lock:
+            if key in self._pending:
+                base, current = self._pending[key]
+            elif key in self._in_flight:
+                base = current = self._in_flight[key][1]
+            else:
+                base = current = persisted
+
+            wanted = dir == 1
+            if wanted == current:
+                return "already_voted" if wanted else "vote_not_found"
+            if wanted == base:
+                del self._pending[key]  # back to the state being written
+            else:
+                self._pending[key] = (base, wanted)
+            self._add_delta(post_id, 1 if wanted else -1)
+            num_pending = len(self._pending)
+
+        cache.evict_post(post_id)  # its vote count changed
+        if num_pending >= settings.VOTE_BUFFER_MAX_PENDING:
+            self._wake_up.set()
+        return "added" if wanted else "removed"
+
+    def _add_delta(self, post_id: int, delta: int) -> None:
+        """This updates the net change of the vote count of a post. The lock
+        must be held."""
+        delta += self._deltas.get(post_id, 0)
+        if delta:
+            self._deltas[post_id] = delta
+        else:
+            self._deltas.pop(post_id, None)
+
+    def deltas(self) -> Dict[int, int]:
+        """This returns the vote count changes not written yet, by post id."""
+        with self._lock:
+            return dict(self._deltas)
+
+    def flush(self) -> int:
+        """This is used to write the pending votes, with one INSERT, one DELETE
+        and one UPDATE of the vote counts. If it fails, the votes are kept for
+        the next flush.
+
+        Returns:
+        --------
+        num_votes: The number of votes written.
+        """
+        with self._lock:
+            self._in_flight, self._pending = self._pending, {}
+        if not self._in_flight:
+            return 0
+        try:
+            voted_posts, deltas = write_votes(self._in_flight)
+        except Exception:
+            logger.exception("The vote buffer flush failed. It will be retried.")
+            with self._lock:
+                self._merge_back()
+            return 0
+
+        with self._lock:
+            for (post_id, _), (base, wanted) in self._in_flight.items():
+                self._add_delta(post_id, int(base) - int(wanted))
+            num_votes, self._in_flight = len(self._in_flight), {}
+        for row in voted_posts:
+            cache.evict_post(row.id)
+            ranking.update_post(row.id, row.vote_count, row.created_at)
+            broadcast.publish_votes(row.id, row.vote_count, deltas[row.id])
+        return num_votes
+
+    def _merge_back(self) -> None:
+        """This puts the votes of a failed flush back in the pending ones. The
+        lock must be held."""
+        for key, (base, wanted) in self._in_flight.items():
+            if key in self._pending:
+                wanted = self._pending[key][1]  # the newer vote wins
+            if base == wanted:
+                self._pending.pop(key, None)
+            else:
+                self._pending[key] = (base, wanted)
+        self._in_flight = {}
+
+    def start(self) -> None:
+        """This starts the thread flushing the buffer every
+        VOTE_BUFFER_FLUSH_SECONDS (or as soon as it's full)."""
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="vote-buffer", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wake_up.wait(settings.VOTE_BUFFER_FLUSH_SECONDS)
+            self._wake_up.clear()
+            self.flush()
+
+    def stop(self) -> None:
+        """This stops the flushing thread and writes the remaining votes."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._wake_up.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+
+def write_votes(changes: VoteChanges) -> Tuple[List[Tuple], Dict[int, int]]:
+    """This is used to apply buffered votes to the votes table and to the vote
+    counts of the posts, in a single transaction.
+
+    Args:
+    -----
+    changes: The votes to write.
+
+    Returns:
+    --------
+    voted_posts: The rows (id, vote_count, created_at) of the posts whose vote
+    count changed.
+    deltas: The change of their vote count, by post id.
+    """
+    added = [key for key, (_, wanted) in changes.items() if wanted]
+    removed = [key for key, (_, wanted) in changes.items() if not wanted]
+    deltas: Dict[int, int] = {}
+    db: Session = database.SessionLocal()
+    try:
+        if added:
+            # skip the votes on posts deleted in the meantime
+            new_votes = values(
+                column("post_id", Integer), column("user_id", Integer), name="new_votes"
+            ).data(added)
+            statement = (
+                insert(models.Votes)
+                .from_select(
+                    ["post_id", "user_id"],
+                    select(new_votes.c.post_id, new_votes.c.user_id).join(
+                        models.Posts, models.Posts.id == new_votes.c.post_id
+                    ),
+                )
+                .on_conflict_do_nothing()
+                .returning(models.Votes.post_id)
+            )
+            for row in db.execute(statement):
+                deltas[row.post_id] = deltas.get(row.post_id, 0) + 1
+        if removed:
+            statement = (
+                delete(models.Votes)
+                .where(tuple_(models.Votes.post_id, models.Votes.user_id).in_(removed))
+                .returning(models.Votes.post_id)
+            )
+            for row in db.execute(statement):
+                deltas[row.post_id] = deltas.get(row.post_id, 0) - 1
+
+        voted_posts = []
+        if deltas:
+            vote_deltas = values(
+                column("post_id", Integer), column("delta", Integer), name="vote_deltas"
+            ).data(list(deltas.items()))
+            voted_posts = db.execute(
+                update(models.Posts)
+                .where(models.Posts.id == vote_deltas.c.post_id)
+                .values(vote_count=models.Posts.vote_count + vote_deltas.c.delta)
+                .returning(
+                    models.Posts.id,
+                    models.Posts.vote_count,
+                    models.Posts.created_at,
+                    *invalidation.returning("post", models.Posts.id),
+                )
+                .execution_options(synchronize_session=False)
+            ).all()
+        db.commit()
+    finally:
+        db.close()
+    return voted_posts, deltas
+
+
+# the buffer of the vote routes (only used when settings.VOTE_BUFFER is on)
+buffer = VoteBuffer()
+
+
+def votes_column():
+    """This returns the `votes` column of the posts queries: the persisted vote
+    count plus the changes still in the buffer, so a voter sees their vote right
+    away (when read by the worker which buffered it).
+
+    The changes are bound as two arrays (post ids, deltas), so the SQL is the
+    same whatever the buffer holds and stays in the statement caches."""
+    deltas = buffer.deltas()
+    if not deltas:
+        return models.Posts.vote_count.label("votes")
+    # (the casts type the parameters for asyncpg)
+    post_ids = cast(list(deltas), ARRAY(Integer))
+    post_deltas = Grouping(  # (...)[i]: a cast can't be subscripted as is
+        cast(list(deltas.values()), ARRAY(Integer))
+    )
+    pending = func.coalesce(
+        post_deltas[func.array_position(post_ids, models.Posts.id)], 0
+    )
+    return (models.Posts.vote_count + pending).label("votes")
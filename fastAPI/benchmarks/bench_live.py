@@ -0,0 +1,206 @@
+"""Benchmark of the live vote counts (/posts/{id}/live) of one worker.
+
+It opens many concurrent subscribers (WebSockets or server-sent events) on a
+post of a running server, votes on the post a few times and reports how long
+the new counts take to reach the subscribers. Start a single worker first:
+
+    uvicorn main:app --port 8000
+    python ../benchmarks/bench_live.py --subscribers 1000 5000 --transport ws
+
+Each subscriber is a connection (and a file descriptor) on both sides, so raise
+`ulimit -n` of the server for large counts.
+"""
+from typing import Dict, List, Tuple
+import argparse
+import asyncio
+import json
+import resource
+import statistics
+import time
+import uuid
+import requests
+
+
+class Subscriber:
+    """This is a benchmark client: it records when each vote count arrives."""
+
+    def __init__(self) -> None:
+        self.received: List[Tuple[float, int]] = []  # (time, vote count)
+
+    async def follow_ws(self, uri: str, connected: asyncio.Event) -> None:
+        import websockets  # only needed for the WebSocket transport
+
+        async with websockets.connect(uri, ping_interval=None) as websocket:
+            await websocket.recv()  # the current count
+            connected.set()
+            async for text in websocket:
+                self.received.append((time.perf_counter(), json.loads(text)["votes"]))
+
+    async def follow_sse(
+        self, host: str, port: int, path: str, connected: asyncio.Event
+    ) -> None:
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(
+            f"GET {path} HTTP/1.1\r\nHost: {host}\r\n"
+            "Accept: text/event-stream\r\n\r\n".encode()
+        )
+        await writer.drain()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                if line.startswith(b"data:"):
+                    if not connected.is_set():
+                        connected.set()  # the current count
+                        continue
+                    votes = json.loads(line[5:])["votes"]
+                    self.received.append((time.perf_counter(), votes))
+        finally:
+            writer.close()
+
+
+def login(base_url: str) -> Tuple[str, Dict[str, str]]:
+    """This is used to create and log in a throwaway user."""
+    email = f"live-{uuid.uuid4().hex[:12]}@bench.example.com"
+    requests.post(f"{base_url}/users/", json={"email": email, "password": "x"})
+    response = requests.post(
+        f"{base_url}/login", data={"username": email, "password": "x"}
+    )
+    response.raise_for_status()
+    token = response.json()["access_token"]
+    return token, {"Authorization": f"Bearer {token}"}
+
+
+def percentile(values: List[float], q: float) -> float:
+    """This returns the q-th percentile (nearest rank) of some values."""
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, round(q / 100 * len(values)) - 1))]
+
+
+async def run(
+    base_url: str, transport: str, num_subscribers: int, num_votes: int, interval: float
+) -> Dict:
+    """This is used to measure the fan-out of the vote counts to some
+    subscribers.
+
+    Args:
+    -----
+    base_url: The URL of the server.
+    transport: "ws" or "sse".
+    num_subscribers: The number of concurrent subscribers.
+    num_votes: The number of votes (alternately added and removed).
+    interval: The delay between two votes (in seconds). It must be above the
+    LIVE_COALESCE_SECONDS of the server, or the updates are coalesced.
+
+    Returns:
+    --------
+    result: The connection and delivery statistics.
+    """
+    loop = asyncio.get_running_loop()
+    token, headers = login(base_url)
+    response = requests.post(
+        f"{base_url}/posts/",
+        json={"title": "live", "content": "bench"},
+        headers=headers,
+    )
+    post_id = response.json()["id"]
+    host, port = base_url.split("://")[1].split(":")
+    path = f"/posts/{post_id}/live?token={token}"
+
+    subscribers = [Subscriber() for _ in range(num_subscribers)]
+    connected = [asyncio.Event() for _ in subscribers]
+    start = time.perf_counter()
+    if transport == "ws":
+        coroutines = [
+            subscriber.follow_ws(f"ws://{host}:{port}{path}", event)
+            for subscriber, event in zip(subscribers, connected)
+        ]
+    else:
+        coroutines = [
+            subscriber.follow_sse(host, int(port), path, event)
+            for subscriber, event in zip(subscribers, connected)
+        ]
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    waits = [asyncio.ensure_future(event.wait()) for event in connected]
+    await asyncio.wait(waits, timeout=60)
+    connect_seconds = time.perf_counter() - start
+    num_connected = sum(event.is_set() for event in connected)
+
+    # alternately add and remove a vote, so the count goes 1, 0, 1...
+    sent: List[Tuple[float, int]] = []
+    for index in range(num_votes):
+        body = {"post_id": post_id, "dir": 1 - index % 2}
+        sent_at = time.perf_counter()
+        await loop.run_in_executor(
+            None, lambda: requests.post(f"{base_url}/votes", json=body, headers=headers)
+        )
+        sent.append((sent_at, 1 - index % 2))
+        await asyncio.sleep(interval)
+    await asyncio.sleep(1)
+
+    latencies, fan_out_times = [], []
+    for index, (sent_at, votes) in enumerate(sent):
+        arrivals = []
+        for subscriber in subscribers:
+            for received_at, count in subscriber.received:
+                if received_at >= sent_at and count == votes:
+                    arrivals.append(received_at - sent_at)
+                    break
+        latencies += arrivals
+        if len(arrivals) == num_connected and arrivals:
+            fan_out_times.append(max(arrivals))
+
+    for task in tasks + waits:
+        task.cancel()
+    await asyncio.gather(*tasks, *waits, return_exceptions=True)
+
+    result = {
+        "connected": num_connected,
+        "connect_seconds": connect_seconds,
+        "delivered": len(latencies) / max(1, num_connected * num_votes),
+        "latency_p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+        "latency_p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+        "fan_out_ms": statistics.mean(fan_out_times) * 1000 if fan_out_times else None,
+    }
+    return result
+
+
+def main() -> None:
+    """This is the entrypoint of the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--transport", choices=["ws", "sse"], default="ws")
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--votes", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=0.5, help="In seconds.")
+    args = parser.parse_args()
+
+    # one file descriptor per subscriber
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+
+    print(
+        f"{'subscribers':>11} {'connected':>9} {'connect s':>9} {'delivered':>9} "
+        f"{'p50 ms':>8} {'p99 ms':>8} {'fan-out ms':>10}"
+    )
+    for num_subscribers in args.subscribers:
+        result = asyncio.run(
+            run(
+                args.base_url,
+                args.transport,
+                num_subscribers,
+                args.votes,
+                args.interval,
+            )
+        )
+        print(
+            f"{num_subscribers:>11} {result['connected']:>9} "
+            f"{result['connect_seconds']:>9.2f} {result['delivered']:>9.1%} "
+            f"{result['latency_p50_ms'] or 0:>8.1f} {result['latency_p99_ms'] or 0:>8.1f} "
+            f"{result['fan_out_ms'] or 0:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
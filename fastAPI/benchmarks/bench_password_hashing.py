@@ -0,0 +1,75 @@
+"""Microbenchmark of the password verification done at login.
+
+It reports how many logins/sec the hashing pool sustains for a range of worker
+counts. Run it from the `fastAPI/app` directory (it needs the `.env` file):
+
+    python ../benchmarks/bench_password_hashing.py --executor process --workers 1 2 4
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import argparse
+import os
+import sys
+import time
+
+curr_dir = os.path.dirname(__file__)
+app_dir = os.path.abspath(os.path.join(curr_dir, "..", "app"))
+
+# insert app_dir into system path
+sys.path.insert(0, app_dir)
+
+import utils
+
+
+def logins_per_second(executor_type: str, workers: int, num_logins: int) -> float:
+    """This is used to measure the login (password verification) throughput.
+
+    Args:
+    -----
+    executor_type: "process" or "thread".
+    workers: The number of workers of the pool.
+    num_logins: The number of concurrent logins to verify.
+
+    Returns:
+    --------
+    throughput: The number of logins verified per second.
+    """
+    hashed_pswd = utils.hash_password("some password")
+    pool_class = (
+        ProcessPoolExecutor if executor_type == "process" else ThreadPoolExecutor
+    )
+    with pool_class(max_workers=workers) as pool:
+        # warm up the workers
+        list(pool.map(utils.verify_password, ["x"] * workers, [hashed_pswd] * workers))
+        start = time.perf_counter()
+        list(
+            pool.map(
+                utils.verify_password,
+                ["some password"] * num_logins,
+                [hashed_pswd] * num_logins,
+            )
+        )
+        elapsed = time.perf_counter() - start
+    return num_logins / elapsed
+
+
+def main() -> None:
+    """This is the entrypoint of the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--executor", choices=["process", "thread"], default="process")
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()]
+    )
+    parser.add_argument("--logins-per-worker", type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"bcrypt rounds: {utils.settings.BCRYPT_ROUNDS}, executor: {args.executor}")
+    print(f"{'workers':>8} {'logins/sec':>12}")
+    for workers in sorted(set(args.workers)):
+        throughput = logins_per_second(
+            args.executor, workers, workers * args.logins_per_worker
+        )
+        print(f"{workers:>8} {throughput:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark of the serialization of a GET /posts page.
+
+It compares the response model path (Pydantic validation, jsonable_encoder and
+the stdlib json) with the orjson fast path (FAST_JSON) and checks that both
+produce the same bytes:
+
+    python fastAPI/benchmarks/bench_serialization.py --page-size 100
+"""
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import List
+import argparse
+import os
+import sys
+import timeit
+
+curr_dir = os.path.dirname(__file__)
+app_dir = os.path.abspath(os.path.join(curr_dir, "..", "app"))
+
+# insert app_dir into system path
+sys.path.insert(0, app_dir)
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import parse_obj_as
+import schemas, serializers
+
+
+def make_page(page_size: int) -> List[SimpleNamespace]:
+    """This is used to build the query rows of a page of posts.
+
+    Args:
+    -----
+    page_size: The number of posts of the page.
+
+    Returns:
+    --------
+    rows: Objects shaped like the rows returned by get_posts.
+    """
+    created_at = datetime(2021, 11, 20, 10, 30, tzinfo=timezone.utc)
+    owner = SimpleNamespace(id=1, email="owner@example.com", created_at=created_at)
+    rows = []
+    for i in range(page_size):
+        post = SimpleNamespace(
+            id=i + 1,
+            title=f"Post número {i}",  # non-ASCII text must be kept as UTF-8
+            content="Some content " * 20,
+            is_published=bool(i % 2),
+            created_at=created_at + timedelta(seconds=i, microseconds=i * 7),
+            owner_id=owner.id,
+            owner=owner,
+        )
+        rows.append(SimpleNamespace(Posts=post, votes=i * 3))
+    return rows
+
+
+def schema_path(rows: List[SimpleNamespace]) -> bytes:
+    """This serializes the rows the way FastAPI does with the response model."""
+    validated = parse_obj_as(List[schemas.PostResponse2], rows)
+    return JSONResponse(content=jsonable_encoder(validated)).body
+
+
+def fast_path(rows: List[SimpleNamespace]) -> bytes:
+    """This serializes the rows with the precompiled projection and orjson."""
+    return serializers.fast_json_response(
+        serializers.project_post_with_votes, rows, Response()
+    ).body
+
+
+def main() -> None:
+    """This is the entrypoint of the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    rows = make_page(args.page_size)
+    assert schema_path(rows) == fast_path(rows), "the JSON bodies are different!"
+
+    print(f"page size: {args.page_size}, the JSON bodies are identical")
+    print(f"{'path':>8} {'ms/page':>10}")
+    for name, func in (("schema", schema_path), ("fast", fast_path)):
+        elapsed = min(timeit.repeat(lambda: func(rows), number=args.repeat, repeat=3))
+        print(f"{name:>8} {elapsed / args.repeat * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Benchmark of the cold start of a worker.
+
+Each run starts a fresh interpreter, imports the app and runs its startup
+hooks, the way a new (autoscaled) worker does. Run it from the `fastAPI/app`
+directory (it needs the `.env` file):
+
+    python ../benchmarks/bench_startup.py --runs 10
+"""
+from typing import Dict
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+curr_dir = os.path.dirname(__file__)
+app_dir = os.path.abspath(os.path.join(curr_dir, "..", "app"))
+
+# the code run by each fresh interpreter. It prints the timings as JSON.
+WORKER_BOOT = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {app_dir!r})
+import main
+imported = time.perf_counter()
+asyncio.run(main.app.router.startup())
+started = time.perf_counter()
+asyncio.run(main.app.router.shutdown())
+print(json.dumps({{"import_ms": (imported - start) * 1000,
+                  "startup_ms": (started - imported) * 1000}}))
+"""
+
+
+def boot_worker() -> Dict[str, float]:
+    """This is used to time the import and the startup hooks of the app in a
+    fresh interpreter.
+
+    Returns:
+    --------
+    timings: The import and startup times (in ms).
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", WORKER_BOOT.format(app_dir=app_dir)],
+        check=True,
+        stdout=subprocess.PIPE,  # the errors are shown on stderr
+        text=True,
+    ).stdout
+    timings = json.loads(output.strip().splitlines()[-1])
+    return timings
+
+
+def main() -> None:
+    """This is the entrypoint of the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [boot_worker() for _ in range(args.runs)]
+    print(f"{'phase':>10} {'min ms':>10} {'median ms':>10}")
+    for phase in ("import_ms", "startup_ms"):
+        values = [run[phase] for run in runs]
+        print(
+            f"{phase[:-3]:>10} {min(values):>10.1f} {statistics.median(values):>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
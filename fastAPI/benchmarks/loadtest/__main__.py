@@ -0,0 +1,134 @@
+"""Load test of the API: synthetic data, load driver and run comparison.
+
+Run it from the `fastAPI/app` directory (it needs the `.env` file):
+
+    python ../benchmarks/loadtest seed --users 1000 --posts 10000
+    uvicorn main:app --workers 4 &
+    python ../benchmarks/loadtest run --concurrency 16 --duration 30 -o new.json
+    python ../benchmarks/loadtest compare base.json new.json --threshold 0.1
+
+The `seed` command migrates the database first. It defaults to the database of
+the app (`--database-url` can point it to another Postgres database). With
+`--reset`, which deletes the existing data, the database must be given with
+`--database-url`.
+"""
+from typing import Dict
+import argparse
+import json
+import os
+import sys
+
+curr_dir = os.path.dirname(__file__)
+app_dir = os.path.abspath(os.path.join(curr_dir, "..", "..", "app"))
+
+# insert app_dir into system path
+sys.path.insert(0, app_dir)
+
+from sqlalchemy import create_engine
+import compare
+import datagen
+import driver
+
+
+def parse_mix(entries) -> Dict[str, float]:
+    """This is used to override the weights of the default mix with
+    "ENDPOINT=WEIGHT" entries (e.g. "GET /posts/{id}=0")."""
+    mix = dict(driver.DEFAULT_MIX)
+    for entry in entries:
+        endpoint, _, weight = entry.rpartition("=")
+        if endpoint not in mix:
+            raise SystemExit(f"Unknown endpoint: {endpoint}")
+        mix[endpoint] = float(weight)
+    return mix
+
+
+def main() -> None:
+    """This is the entrypoint of the load test."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed = commands.add_parser("seed", help="Generate the users, posts and votes.")
+    seed.add_argument("--database-url", help="Defaults to the app database.")
+    seed.add_argument("--users", type=int, default=1000)
+    seed.add_argument("--posts", type=int, default=10000)
+    seed.add_argument("--votes-per-user", type=int, default=20)
+    seed.add_argument("--skew", type=float, default=1.1, help="Zipf exponent.")
+    seed.add_argument("--seed", type=int, default=42)
+    seed.add_argument(
+        "--reset",
+        action="store_true",
+        help="Replace the data. Needs an explicit --database-url.",
+    )
+    seed.add_argument("--manifest", default="loadtest-data.json")
+
+    run = commands.add_parser("run", help="Drive the running server.")
+    run.add_argument("--base-url", default="http://127.0.0.1:8000")
+    run.add_argument("--manifest", default="loadtest-data.json")
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--duration", type=float, default=30, help="In seconds.")
+    run.add_argument("--seed", type=int, default=42)
+    run.add_argument("--mix", action="append", default=[], help='e.g. "GET /users=0"')
+    run.add_argument("-o", "--output", help="The JSON report (default: stdout).")
+
+    diff = commands.add_parser("compare", help="Compare two reports.")
+    diff.add_argument("base")
+    diff.add_argument("new")
+    diff.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        if args.reset and args.database_url is None:
+            # don't wipe the database of the app (e.g. read from .env) by default
+            seed.error(
+                "--reset deletes every user, post and vote: it needs the "
+                "--database-url of the database to reset."
+            )
+        if args.database_url is None:
+            import database
+
+            args.database_url = database.SQLALCHEMY_DATABASE_URL
+        engine = create_engine(args.database_url)
+        manifest = datagen.seed_database(
+            engine,
+            args.users,
+            args.posts,
+            args.votes_per_user,
+            args.skew,
+            args.seed,
+            args.reset,
+        )
+        with open(args.manifest, "w") as f:
+            json.dump(manifest, f, indent=2)
+        print(f"Generated {json.dumps(manifest)}")
+
+    elif args.command == "run":
+        with open(args.manifest) as f:
+            manifest = json.load(f)
+        report = driver.run(
+            args.base_url,
+            manifest,
+            args.concurrency,
+            args.duration,
+            parse_mix(args.mix),
+            args.seed,
+        )
+        output = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(output)
+        else:
+            print(output)
+
+    elif args.command == "compare":
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        rows = compare.compare(base, new, args.threshold)
+        print(compare.format_table(rows))
+        if any(row["regressions"] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Comparison of two load test reports."""
+from typing import Dict, List
+
+
+def compare(base: Dict, new: Dict, threshold: float) -> List[Dict]:
+    """This is used to compare the endpoints of two runs. An endpoint regressed
+    when its p50/p99 latency grew, or its throughput dropped, by more than
+    `threshold`.
+
+    Args:
+    -----
+    base: The report of the reference run.
+    new: The report of the run to check.
+    threshold: The tolerated relative change (e.g. 0.1 = 10%).
+
+    Returns:
+    --------
+    rows: The base/new values, their relative changes and the regressions of
+    each endpoint present in both runs.
+    """
+    rows = []
+    for endpoint, before in base["endpoints"].items():
+        after = new["endpoints"].get(endpoint)
+        if after is None:
+            continue
+        row = {"endpoint": endpoint, "regressions": []}
+        for stat, higher_is_worse in (
+            ("p50_ms", True),
+            ("p99_ms", True),
+            ("throughput_rps", False),
+        ):
+            change = (after[stat] - before[stat]) / before[stat] if before[stat] else 0
+            row[stat] = {"base": before[stat], "new": after[stat], "change": change}
+            worse = change > threshold if higher_is_worse else change < -threshold
+            if worse:
+                row["regressions"].append(stat)
+        rows.append(row)
+    return rows
+
+
+def format_table(rows: List[Dict]) -> str:
+    """This formats the comparison as a text table."""
+    lines = [f"{'endpoint':<24} {'p50 ms':>18} {'p99 ms':>18} {'req/s':>18}  regressed"]
+    for row in rows:
+        cells = [
+            f"{row[stat]['new']:>9.1f} ({row[stat]['change']:>+6.1%})"
+            for stat in ("p50_ms", "p99_ms", "throughput_rps")
+        ]
+        regressed = ", ".join(row["regressions"]) or "-"
+        lines.append(f"{row['endpoint']:<24} {' '.join(cells)}  {regressed}")
+    return "\n".join(lines)
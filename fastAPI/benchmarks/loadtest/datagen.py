@@ -0,0 +1,168 @@
+"""Synthetic data generator of the load test.
+
+The popularity of the posts follows a Zipf law: a few posts (the lowest ids)
+get most of the votes and reads, like viral posts do.
+"""
+from itertools import accumulate
+from typing import Dict, List, Tuple
+import random
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.engine import Engine
+import migrations
+import models
+import utils
+
+
+# the words of the generated titles/contents (and of the search terms)
+WORDS = (
+    "python fastapi postgres async cache index query vote post user latency "
+    "throughput server client stream batch json socket worker thread queue "
+    "pool cursor search rank trend feed viral social share like comment "
+    "photo video music travel food coffee morning night weekend city beach "
+    "mountain river forest garden book movie game code data cloud"
+).split()
+
+# the password of every generated user
+PASSWORD = "benchmark-password"
+
+# the number of rows inserted per statement
+INSERT_CHUNK_SIZE = 5000
+
+
+def email(user_id: int) -> str:
+    """This returns the email of a generated user."""
+    return f"user{user_id}@bench.example.com"
+
+
+def popularity_weights(num_posts: int, skew: float) -> List[float]:
+    """This is used to get the cumulative (Zipf) popularity weights of the
+    posts. The first post is the most popular one.
+
+    Args:
+    -----
+    num_posts: The number of posts.
+    skew: The Zipf exponent. 0 = uniform, ~1 = a few viral posts.
+
+    Returns:
+    --------
+    cum_weights: The cumulative weights, for `random.choices`.
+    """
+    return list(accumulate(1 / (rank + 1) ** skew for rank in range(num_posts)))
+
+
+def sentence(rng: random.Random, min_words: int, max_words: int) -> str:
+    """This returns a random sentence made of WORDS."""
+    return " ".join(rng.choices(WORDS, k=rng.randint(min_words, max_words)))
+
+
+def generate(
+    num_users: int, num_posts: int, votes_per_user: int, skew: float, seed: int
+) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+    """This is used to generate the rows of the users, posts and votes tables.
+    The ids start at 1 and the vote counters match the votes.
+
+    Args:
+    -----
+    num_users: The number of users.
+    num_posts: The number of posts (owned by random users).
+    votes_per_user: The average number of votes of a user.
+    skew: The Zipf exponent of the popularity of the posts.
+    seed: The seed of the random generator (the data is reproducible).
+
+    Returns:
+    --------
+    tables: The rows of the users, posts and votes.
+    """
+    rng = random.Random(seed)
+    password = utils.hash_password(PASSWORD)
+    users = [
+        {"id": id, "email": email(id), "password": password}
+        for id in range(1, num_users + 1)
+    ]
+
+    cum_weights = popularity_weights(num_posts, skew)
+    post_ids = range(1, num_posts + 1)
+    vote_counts = [0] * (num_posts + 1)
+    votes = []
+    for user_id in range(1, num_users + 1):
+        num_votes = min(rng.randint(0, 2 * votes_per_user), num_posts)
+        for post_id in set(rng.choices(post_ids, cum_weights=cum_weights, k=num_votes)):
+            votes.append({"user_id": user_id, "post_id": post_id})
+            vote_counts[post_id] += 1
+
+    posts = [
+        {
+            "id": id,
+            "title": sentence(rng, 3, 8),
+            "content": sentence(rng, 20, 80),
+            "is_published": rng.random() < 0.9,
+            "owner_id": rng.randint(1, num_users),
+            "vote_count": vote_counts[id],
+        }
+        for id in post_ids
+    ]
+    return users, posts, votes
+
+
+def seed_database(
+    engine: Engine,
+    num_users: int,
+    num_posts: int,
+    votes_per_user: int,
+    skew: float,
+    seed: int,
+    reset: bool = False,
+) -> Dict:
+    """This is used to migrate a database and fill it with generated data.
+
+    Args:
+    -----
+    engine: The engine of the (Postgres) database.
+    num_users: The number of users.
+    num_posts: The number of posts.
+    votes_per_user: The average number of votes of a user.
+    skew: The Zipf exponent of the popularity of the posts.
+    seed: The seed of the random generator.
+    reset: Delete the existing users/posts/votes first. Without it, the tables
+    must be empty.
+
+    Returns:
+    --------
+    manifest: What the load driver needs to know about the data.
+    """
+    migrations.migrate(engine)
+    users, posts, votes = generate(num_users, num_posts, votes_per_user, skew, seed)
+
+    with engine.begin() as conn:
+        if reset:
+            for table in ("votes", "posts", "users"):
+                conn.execute(text(f"DELETE FROM {table}"))
+        elif conn.execute(select(func.count()).select_from(models.Users)).scalar():
+            raise SystemExit("The database isn't empty. Use --reset to replace it.")
+
+        for model, rows in ((models.Users, users), (models.Posts, posts)):
+            for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+                conn.execute(insert(model), rows[start : start + INSERT_CHUNK_SIZE])
+        for start in range(0, len(votes), INSERT_CHUNK_SIZE):
+            conn.execute(insert(models.Votes), votes[start : start + INSERT_CHUNK_SIZE])
+
+        if conn.dialect.name == "postgresql":
+            # the ids were given explicitly, so move the sequences past them
+            for table, last_id in (("users", num_users), ("posts", num_posts)):
+                conn.execute(
+                    text(
+                        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), :id)"
+                    ),
+                    {"id": max(last_id, 1)},
+                )
+
+    manifest = {
+        "num_users": num_users,
+        "num_posts": num_posts,
+        "num_votes": len(votes),
+        "votes_per_user": votes_per_user,
+        "skew": skew,
+        "seed": seed,
+        "password": PASSWORD,
+    }
+    return manifest
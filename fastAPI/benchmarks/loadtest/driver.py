@@ -0,0 +1,311 @@
+"""Load driver of the load test.
+
+It runs `concurrency` clients against a running server, each one doing a
+weighted random mix of requests on every route, and reports the throughput and
+the latency percentiles per endpoint.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+import json
+import random
+import time
+import requests
+import datagen
+
+
+# the relative frequency of each request of the mix. The reads of single posts
+# dominate, like on a social feed.
+DEFAULT_MIX = {
+    "POST /login": 2,
+    "POST /users/": 1,
+    "GET /users/{id}": 5,
+    "GET /users": 0.2,
+    "GET /posts/": 20,
+    "GET /posts/ (search)": 5,
+    "GET /posts/{id}": 40,
+    "GET /posts/top": 5,
+    "GET /posts/trending": 5,
+    "GET /posts/export": 0.2,
+    "POST /posts/": 5,
+    "POST /posts/bulk": 0.5,
+    "PUT /posts/{id}": 3,
+    "DELETE /posts/{id}": 2,
+    "POST /votes": 15,
+    "POST /votes/batch": 2,
+}
+
+
+class Client:
+    """This is a client of the load test: a logged-in user doing requests.
+
+    Args:
+    -----
+    base_url: The URL of the server.
+    manifest: The description of the generated data.
+    index: The index of the client (it picks the user and the random seed).
+    seed: The seed of the run.
+    """
+
+    def __init__(self, base_url: str, manifest: Dict, index: int, seed: int) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.manifest = manifest
+        self.rng = random.Random(seed * 1000 + index)
+        self.user_id = index % manifest["num_users"] + 1
+        self.cum_weights = datagen.popularity_weights(
+            manifest["num_posts"], manifest["skew"]
+        )
+        self.own_posts: List[int] = []
+        self.session = requests.Session()
+        self.login()
+
+    def url(self, path: str) -> str:
+        return self.base_url + path
+
+    def login(self) -> requests.Response:
+        response = self.session.post(
+            self.url("/login"),
+            data={
+                "username": datagen.email(self.user_id),
+                "password": self.manifest["password"],
+            },
+        )
+        if response.ok:
+            token = response.json()["access_token"]
+            self.session.headers["Authorization"] = f"Bearer {token}"
+        return response
+
+    def popular_post(self) -> int:
+        """This picks a post id, the popular posts being picked more often."""
+        return self.rng.choices(
+            range(1, self.manifest["num_posts"] + 1), cum_weights=self.cum_weights
+        )[0]
+
+    def new_post(self) -> Dict:
+        return {
+            "title": datagen.sentence(self.rng, 3, 8),
+            "content": datagen.sentence(self.rng, 20, 80),
+        }
+
+    def create_user(self) -> requests.Response:
+        email = f"load-{self.rng.getrandbits(64):x}@bench.example.com"
+        return self.session.post(
+            self.url("/users/"), json={"email": email, "password": "x"}
+        )
+
+    def get_user(self) -> requests.Response:
+        user_id = self.rng.randint(1, self.manifest["num_users"])
+        return self.session.get(self.url(f"/users/{user_id}"))
+
+    def get_users(self) -> requests.Response:
+        return self.session.get(self.url("/users"))
+
+    def get_posts(self) -> requests.Response:
+        skip = self.rng.randint(0, 100)
+        return self.session.get(self.url("/posts/"), params={"skip": skip})
+
+    def search_posts(self) -> requests.Response:
+        params = {"search": self.rng.choice(datagen.WORDS), "rank": "true"}
+        return self.session.get(self.url("/posts/"), params=params)
+
+    def get_post(self) -> requests.Response:
+        return self.session.get(self.url(f"/posts/{self.popular_post()}"))
+
+    def get_top_posts(self) -> requests.Response:
+        return self.session.get(self.url("/posts/top"))
+
+    def get_trending_posts(self) -> requests.Response:
+        return self.session.get(self.url("/posts/trending"))
+
+    def export_posts(self) -> requests.Response:
+        return self.session.get(self.url("/posts/export"), params={"format": "ndjson"})
+
+    def create_post(self) -> requests.Response:
+        response = self.session.post(self.url("/posts/"), json=self.new_post())
+        if response.ok:
+            self.own_posts.append(response.json()["id"])
+        return response
+
+    def bulk_create_posts(self) -> requests.Response:
+        body = "\n".join(json.dumps(self.new_post()) for _ in range(10))
+        response = self.session.post(
+            self.url("/posts/bulk"),
+            data=body.encode(),
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        if response.ok:
+            self.own_posts += response.json()["inserted_ids"]
+        return response
+
+    def update_post(self) -> Optional[requests.Response]:
+        if not self.own_posts:
+            return None
+        post_id = self.rng.choice(self.own_posts)
+        return self.session.put(self.url(f"/posts/{post_id}"), json=self.new_post())
+
+    def delete_post(self) -> Optional[requests.Response]:
+        if not self.own_posts:
+            return None
+        post_id = self.own_posts.pop(self.rng.randrange(len(self.own_posts)))
+        return self.session.delete(self.url(f"/posts/{post_id}"))
+
+    def vote(self) -> requests.Response:
+        body = {"post_id": self.popular_post(), "dir": self.rng.randint(0, 1)}
+        return self.session.post(self.url("/votes"), json=body)
+
+    def vote_batch(self) -> requests.Response:
+        body = [
+            {"post_id": self.popular_post(), "dir": self.rng.randint(0, 1)}
+            for _ in range(5)
+        ]
+        return self.session.post(self.url("/votes/batch"), json=body)
+
+    def operations(self) -> Dict[str, Callable[[], Optional[requests.Response]]]:
+        """This maps the endpoints of the mix to the methods doing them."""
+        return {
+            "POST /login": self.login,
+            "POST /users/": self.create_user,
+            "GET /users/{id}": self.get_user,
+            "GET /users": self.get_users,
+            "GET /posts/": self.get_posts,
+            "GET /posts/ (search)": self.search_posts,
+            "GET /posts/{id}": self.get_post,
+            "GET /posts/top": self.get_top_posts,
+            "GET /posts/trending": self.get_trending_posts,
+            "GET /posts/export": self.export_posts,
+            "POST /posts/": self.create_post,
+            "POST /posts/bulk": self.bulk_create_posts,
+            "PUT /posts/{id}": self.update_post,
+            "DELETE /posts/{id}": self.delete_post,
+            "POST /votes": self.vote,
+            "POST /votes/batch": self.vote_batch,
+        }
+
+
+Sample = Tuple[str, int, float]  # (endpoint, status code, latency in seconds)
+
+
+def run_client(
+    base_url: str,
+    manifest: Dict,
+    mix: Dict[str, float],
+    index: int,
+    seed: int,
+    deadline: float,
+) -> List[Sample]:
+    """This is used to run a client until the deadline.
+
+    Returns:
+    --------
+    samples: The endpoint, status code (0 = connection error) and latency of
+    every request.
+    """
+    client = Client(base_url, manifest, index, seed)
+    operations = client.operations()
+    endpoints = [endpoint for endpoint in mix if mix[endpoint] > 0]
+    weights = [mix[endpoint] for endpoint in endpoints]
+    samples = []
+    while time.perf_counter() < deadline:
+        endpoint = client.rng.choices(endpoints, weights=weights)[0]
+        start = time.perf_counter()
+        try:
+            # the whole body is read, so an export is timed until its last byte
+            response = operations[endpoint]()
+            if response is None:  # e.g. no post to update yet
+                continue
+            status_code = response.status_code
+        except requests.RequestException:
+            status_code = 0
+        samples.append((endpoint, status_code, time.perf_counter() - start))
+    return samples
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """This returns the q-th percentile (nearest rank) of sorted values."""
+    index = max(
+        0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values))) - 1)
+    )
+    return sorted_values[index]
+
+
+def summarize(samples: List[Sample], duration: float) -> Dict:
+    """This is used to compute the throughput and the latency percentiles of
+    each endpoint (and of all of them).
+
+    Args:
+    -----
+    samples: The requests of the run.
+    duration: The duration of the run (in seconds).
+
+    Returns:
+    --------
+    summary: The stats per endpoint and in total.
+    """
+    groups: Dict[str, List[Sample]] = {}
+    for sample in samples:
+        groups.setdefault(sample[0], []).append(sample)
+    groups["total"] = samples
+
+    summary = {}
+    for endpoint, group in sorted(groups.items()):
+        latencies = sorted(latency for _, _, latency in group)
+        statuses: Dict[str, int] = {}
+        for _, status_code, _ in group:
+            statuses[str(status_code)] = statuses.get(str(status_code), 0) + 1
+        summary[endpoint] = {
+            "requests": len(group),
+            "errors": sum(1 for _, code, _ in group if code == 0 or code >= 500),
+            "statuses": statuses,
+            "throughput_rps": len(group) / duration,
+            "mean_ms": sum(latencies) / len(latencies) * 1000,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+        }
+    return summary
+
+
+def run(
+    base_url: str,
+    manifest: Dict,
+    concurrency: int,
+    duration: float,
+    mix: Dict[str, float],
+    seed: int,
+) -> Dict:
+    """This is used to run the load test.
+
+    Args:
+    -----
+    base_url: The URL of the server.
+    manifest: The description of the generated data (see datagen.py).
+    concurrency: The number of concurrent clients.
+    duration: The duration of the run (in seconds).
+    mix: The relative frequency of each endpoint.
+    seed: The seed of the random choices of the clients.
+
+    Returns:
+    --------
+    report: The configuration of the run and the stats of each endpoint.
+    """
+    started_at = datetime.now(timezone.utc).isoformat()
+    start = time.perf_counter()
+    deadline = start + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(run_client, base_url, manifest, mix, index, seed, deadline)
+            for index in range(concurrency)
+        ]
+        samples = [sample for future in futures for sample in future.result()]
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "started_at": started_at,
+        "base_url": base_url,
+        "concurrency": concurrency,
+        "duration_s": elapsed,
+        "seed": seed,
+        "mix": mix,
+        "data": manifest,
+        "endpoints": summarize(samples, elapsed),
+    }
+    return report
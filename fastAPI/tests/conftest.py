@@ -0,0 +1,70 @@
+"""The tests run the app against the Postgres database configured by the
+DATABASE_* environment variables (or the .env file), like the app itself. They
+are skipped when it can't be reached. Run them from the fastAPI directory:
+
+    python -m pytest tests
+"""
+from typing import Dict
+import os
+import sys
+import uuid
+import pytest
+from sqlalchemy import exc
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "app")
+sys.path.insert(0, APP_DIR)
+
+# the settings of a local database when none is configured, so the tests which
+# don't use it (no `client`) run anyway
+for name, value in [
+    ("DATABASE_HOST", "localhost"),
+    ("DATABASE_USER", "postgres"),
+    ("DATABASE_NAME", "fastapi"),
+    ("DATABASE_PORT", "5432"),
+    ("DATABASE_PASSWORD", "postgres"),
+    ("SECRET_KEY", "test-secret-key"),
+    ("ALGORITHM", "HS256"),
+    ("ACCESS_TOKEN_EXPIRATION_MINUTES", "30"),
+]:
+    os.environ.setdefault(name, value)
+
+# fast password hashing, and no cached posts (each request hits the database)
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("PASSWORD_HASHING_EXECUTOR", "thread")
+os.environ.setdefault("POST_CACHE_SIZE", "0")
+
+
+@pytest.fixture(scope="session")
+def client():
+    """This is a client of the app, on a migrated database."""
+    from fastapi.testclient import TestClient
+    import database
+    import main
+    import migrations
+
+    database.init_engines()
+    try:
+        migrations.migrate(database.engine)
+    except exc.OperationalError as e:
+        pytest.skip(f"The database can't be reached: {e}")
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+def create_user(client) -> Dict[str, str]:
+    """This is used to create a user and log it in.
+
+    Returns:
+    --------
+    auth_headers: Its Authorization header.
+    """
+    email = f"test-{uuid.uuid4().hex[:12]}@example.com"
+    client.post("/users/", json={"email": email, "password": "password"})
+    response = client.post("/login", data={"username": email, "password": "password"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture(scope="session")
+def auth_headers(client) -> Dict[str, str]:
+    """This is the Authorization header of a new user."""
+    return create_user(client)
@@ -0,0 +1,71 @@
+import asyncio
+import pytest
+import broadcast
+
+
+def votes(count: int, delta: int):
+    return {"event": "votes", "post_id": 1, "votes": count, "delta": delta}
+
+
+def test_vote_updates_are_coalesced():
+    subscriber = broadcast.Subscriber(queue_size=2)
+    assert subscriber.put(votes(1, 1)) == "queued"
+    assert subscriber.put(votes(3, 2)) == "coalesced"
+    assert subscriber.put(votes(2, -1)) == "coalesced"
+    assert list(subscriber.queue) == [votes(2, 2)]
+
+
+def test_other_events_are_not_coalesced():
+    subscriber = broadcast.Subscriber(queue_size=3)
+    deleted = {"event": "deleted", "post_id": 1}
+    assert subscriber.put(votes(1, 1)) == "queued"
+    assert subscriber.put(deleted) == "queued"
+    assert subscriber.put(votes(0, -1)) == "queued"
+    assert list(subscriber.queue) == [votes(1, 1), deleted, votes(0, -1)]
+
+
+def test_queue_overflow_disconnects():
+    subscriber = broadcast.Subscriber(queue_size=1)
+    assert subscriber.put(votes(1, 1)) == "queued"
+    assert subscriber.put({"event": "deleted", "post_id": 1}) == "dropped"
+    with pytest.raises(broadcast.SlowConsumer):
+        asyncio.run(subscriber.get(timeout=1))
+
+
+def test_get_returns_the_queued_messages():
+    async def receive():
+        subscriber = broadcast.Subscriber(queue_size=2)
+        assert await subscriber.get(timeout=0.01) == []
+        subscriber.put(votes(1, 1))
+        subscriber.put(votes(2, 1))
+        return await subscriber.get(timeout=1), list(subscriber.queue)
+
+    messages, waiting = asyncio.run(receive())
+    assert messages == [votes(2, 2)]
+    assert waiting == []
+
+
+def test_broadcaster_drops_slow_subscribers(monkeypatch):
+    monkeypatch.setattr(broadcast.settings, "LIVE_QUEUE_SIZE", 1)
+
+    async def publish():
+        broadcaster = broadcast.Broadcaster()
+        broadcaster.start(asyncio.get_running_loop())
+        broadcaster.publish(2, votes(1, 1))  # no subscriber: nothing to do
+        subscriber = broadcaster.subscribe(1)
+        broadcaster.publish(1, votes(1, 1))
+        broadcaster.publish(1, votes(2, 1))
+        broadcaster.publish(1, {"event": "deleted", "post_id": 1})
+        await asyncio.sleep(0)  # the messages are delivered by the loop
+        return broadcaster.stats(), subscriber
+
+    stats, subscriber = asyncio.run(publish())
+    assert stats == {
+        "subscribers": 0,
+        "posts": 0,
+        "published": 3,
+        "queued": 1,
+        "coalesced": 1,
+        "dropped": 1,
+    }
+    assert subscriber.dropped
@@ -0,0 +1,32 @@
+import invalidation
+
+
+def test_format_payloads_splits_large_notifications():
+    ids = range(100000, 103000)
+    payloads = invalidation.format_payloads("post", ids)
+
+    assert len(payloads) > 1
+    assert all(len(payload) <= invalidation.MAX_PAYLOAD_BYTES for payload in payloads)
+    assert all(payload.startswith("post:") for payload in payloads)
+    sent = [int(id) for p in payloads for id in p.partition(":")[2].split(",")]
+    assert sent == list(ids)
+
+
+def test_format_payloads_sorts_and_deduplicates():
+    assert invalidation.format_payloads("post", [3, 1, 3, 2]) == ["post:1,2,3"]
+    assert invalidation.format_payloads("post", []) == []
+
+
+def test_apply_evicts_the_ids_of_the_kind(monkeypatch):
+    monkeypatch.setattr(invalidation, "handlers", {})
+    posts, users, flushed = [], [], []
+    invalidation.register("post", posts.append, lambda: flushed.append("post"))
+    invalidation.register("user", users.append, lambda: flushed.append("user"))
+
+    invalidation.apply("post:12,13")
+    invalidation.apply("comment:1")  # no local cache of this kind
+    assert posts == [12, 13]
+    assert users == []
+
+    invalidation.flush_all()
+    assert flushed == ["post", "user"]
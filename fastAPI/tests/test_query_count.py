@@ -0,0 +1,67 @@
+from typing import List
+import pytest
+from sqlalchemy import event
+from config import settings
+import database
+import utils
+
+from conftest import create_user
+
+
+class StatementCounter:
+    """This counts the SQL statements run by the primary engine."""
+
+    def __init__(self) -> None:
+        self.statements: List[str] = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, many) -> None:
+        self.statements.append(statement)
+
+    def __enter__(self) -> "StatementCounter":
+        event.listen(database.engine, "before_cursor_execute", self)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        event.remove(database.engine, "before_cursor_execute", self)
+
+
+@pytest.fixture(scope="module")
+def post_ids(client) -> List[int]:
+    """This creates enough posts to fill the largest page. Consecutive posts
+    have different owners, so a lazy load of the owners would show up."""
+    owners = [create_user(client) for _ in range(20)]
+    ids = []
+    for index in range(100):
+        body = {"title": f"post {index}", "content": "The N+1 test."}
+        headers = owners[index % len(owners)]
+        ids.append(client.post("/posts/", json=body, headers=headers).json()["id"])
+    return ids
+
+
+def count_statements(client, auth_headers, url: str) -> int:
+    """This returns the number of statements run to serve a GET request."""
+    client.get(url, headers=auth_headers)  # the user is authenticated (and cached)
+    with StatementCounter() as counter:
+        response = client.get(url, headers=auth_headers)
+    assert response.status_code == 200
+    return len(counter.statements)
+
+
+@pytest.mark.parametrize("fast_json", [False, True])
+def test_posts_page_statements_dont_depend_on_page_size(
+    client, auth_headers, post_ids, monkeypatch, fast_json
+):
+    monkeypatch.setattr(settings, "FAST_JSON", fast_json)
+    cursor = utils.encode_cursor(post_ids[0] - 1)  # the pages start at post_ids
+    counts = {
+        limit: count_statements(
+            client, auth_headers, f"/posts/?limit={limit}&cursor={cursor}"
+        )
+        for limit in (1, 10, 100)
+    }
+    assert counts[1] == counts[10] == counts[100] == 1, counts
+
+
+def test_post_statements(client, auth_headers, post_ids):
+    count = count_statements(client, auth_headers, f"/posts/{post_ids[0]}")
+    assert count == 1
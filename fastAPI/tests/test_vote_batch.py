@@ -0,0 +1,43 @@
+from pydantic import parse_obj_as
+import schemas
+from routes.vote import replay_votes
+
+
+def replay(votes, existing_posts, initial_votes):
+    body = parse_obj_as(
+        schemas.VoteBatch, [{"post_id": id, "dir": dir} for id, dir in votes]
+    )
+    outcomes, final_votes = replay_votes(body, existing_posts, initial_votes)
+    return [outcome["outcome"] for outcome in outcomes], final_votes
+
+
+def test_votes_are_replayed_in_order():
+    outcomes, final_votes = replay(
+        [(1, 1), (1, 1), (1, 0), (1, 0), (1, 1)],
+        existing_posts={1},
+        initial_votes=set(),
+    )
+    assert outcomes == ["added", "already_voted", "removed", "vote_not_found", "added"]
+    assert final_votes == {1}
+
+
+def test_votes_start_from_the_persisted_ones():
+    outcomes, final_votes = replay(
+        [(1, 1), (2, 0), (3, 0)], existing_posts={1, 2, 3}, initial_votes={1, 2}
+    )
+    assert outcomes == ["already_voted", "removed", "vote_not_found"]
+    assert final_votes == {1}
+
+
+def test_votes_on_missing_posts():
+    outcomes, final_votes = replay(
+        [(1, 1), (4, 1), (4, 0)], existing_posts={1}, initial_votes=set()
+    )
+    assert outcomes == ["added", "post_not_found", "post_not_found"]
+    assert final_votes == {1}
+
+
+def test_the_input_is_not_changed():
+    initial_votes = {1}
+    replay([(1, 0)], existing_posts={1}, initial_votes=initial_votes)
+    assert initial_votes == {1}
@@ -0,0 +1,61 @@
+import pytest
+import votebuffer
+
+
+@pytest.fixture
+def buffer() -> votebuffer.VoteBuffer:
+    """This is an empty vote buffer (its thread isn't started)."""
+    return votebuffer.VoteBuffer()
+
+
+def test_record_replays_the_votes(buffer):
+    assert buffer.record(1, 10, 1, persisted=False) == "added"
+    assert buffer.record(1, 10, 1, persisted=False) == "already_voted"
+    assert buffer.record(1, 11, 0, persisted=False) == "vote_not_found"
+    assert buffer.record(2, 10, 0, persisted=True) == "removed"
+    assert buffer.record(2, 10, 0, persisted=True) == "vote_not_found"
+    assert buffer.deltas() == {1: 1, 2: -1}
+
+
+def test_record_cancels_out(buffer):
+    assert buffer.record(1, 10, 1, persisted=False) == "added"
+    assert buffer.record(1, 10, 0, persisted=False) == "removed"
+    assert buffer.deltas() == {}
+    assert buffer.flush() == 0  # nothing to write
+
+
+def test_flush_writes_the_net_votes(buffer, monkeypatch):
+    written = []
+
+    def write_votes(changes):
+        written.append(dict(changes))
+        return [], {}
+
+    monkeypatch.setattr(votebuffer, "write_votes", write_votes)
+    buffer.record(1, 10, 1, persisted=False)
+    buffer.record(1, 11, 0, persisted=True)
+    buffer.record(2, 10, 1, persisted=False)
+    buffer.record(2, 10, 0, persisted=False)
+
+    assert buffer.flush() == 2
+    assert written == [{(1, 10): (False, True), (1, 11): (True, False)}]
+    assert buffer.deltas() == {}
+    assert buffer.flush() == 0
+
+
+def test_failed_flush_keeps_the_votes(buffer, monkeypatch):
+    def write_votes(changes):
+        # votes recorded while the flush runs
+        assert buffer.record(1, 10, 0, persisted=False) == "removed"
+        assert buffer.record(3, 10, 1, persisted=False) == "added"
+        raise OSError("connection lost")
+
+    monkeypatch.setattr(votebuffer, "write_votes", write_votes)
+    buffer.record(1, 10, 1, persisted=False)
+    buffer.record(2, 10, 1, persisted=False)
+
+    assert buffer.flush() == 0
+    # the newer vote on post 1 cancelled the failed one
+    assert buffer._pending == {(2, 10): (False, True), (3, 10): (False, True)}
+    assert buffer._in_flight == {}
+    assert buffer.deltas() == {2: 1, 3: 1}